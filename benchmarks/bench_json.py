@@ -0,0 +1,119 @@
+"""Compares the JSON backends of funsize.codec on funsize payloads.
+
+Usage: python benchmarks/bench_json.py [-n RUNS] [--releases N] [--locales N]
+
+Payloads:
+- a names_only Balrog /releases response with N release names
+- a Balrog build blob
+- a buildbot l10n repack pulse message with N locales, including the
+  nested funsize_info and locales properties parsed by
+  parse_buildbot_message
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from funsize import codec  # noqa: E402
+
+import json  # noqa: E402
+
+
+def release_list(count):
+    names = ["Firefox-mozilla-central-nightly-2016{:02d}{:02d}{:06d}".format(
+        i % 12 + 1, i % 28 + 1, i) for i in range(count)]
+    return json.dumps({"names": names})
+
+
+def build_blob():
+    return json.dumps({
+        "appVersion": "52.0a1",
+        "buildID": "20161019030208",
+        "displayVersion": "52.0a1",
+        "platformVersion": "52.0a1",
+        "completes": [{
+            "from": "*",
+            "filesize": 52428800,
+            "hashValue": "f" * 128,
+            "fileUrl": "https://archive.mozilla.org/pub/firefox/nightly/"
+                       "2016/10/2016-10-19-03-02-08-mozilla-central/"
+                       "firefox-52.0a1.de.linux-x86_64.complete.mar",
+        }],
+    })
+
+
+def l10n_message(count):
+    locales = ["l{:03d}".format(i) for i in range(count)]
+    funsize_info = {
+        "appName": "Firefox",
+        "branch": "mozilla-central",
+        "platform": "linux64",
+        "mar_signing_format": "mar",
+        "completeMarUrls": dict(
+            (locale, "https://archive.mozilla.org/pub/firefox/nightly/"
+                     "latest-mozilla-central-l10n/"
+                     "firefox-52.0a1.{}.linux-x86_64.complete.mar".format(
+                         locale))
+            for locale in locales),
+    }
+    properties = [
+        ["funsize_info", json.dumps(funsize_info), "postrun.py"],
+        ["locales", json.dumps(dict((loc, "Success") for loc in locales)),
+         "postrun.py"],
+        ["revision", "a" * 40, "Build"],
+        ["branch", "mozilla-central", "Build"],
+        ["platform", "linux64", "Build"],
+    ] + [["property{}".format(i), "value" * 10, "Build"] for i in range(50)]
+    return json.dumps({
+        "_meta": {"sent": "2016-10-19T12:00:01.500Z"},
+        "payload": {
+            "results": 0,
+            "build": {
+                "builderName": "Firefox mozilla-central linux64 l10n "
+                               "nightly-1",
+                "properties": properties,
+            },
+        },
+    })
+
+
+def parse_l10n(data):
+    properties = dict((p[0], p[1]) for p in
+                      codec.loads(data)["payload"]["build"]["properties"])
+    codec.loads(properties["funsize_info"])
+    codec.loads(properties["locales"])
+
+
+def bench(function, data, runs):
+    number = 10
+    timings = timeit.repeat(lambda: function(data), number=number,
+                            repeat=runs)
+    return min(timings) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--releases", type=int, default=50000)
+    parser.add_argument("--locales", type=int, default=100)
+    args = parser.parse_args()
+    payloads = [
+        ("release list, {} names".format(args.releases),
+         release_list(args.releases), codec.loads),
+        ("build blob", build_blob(), codec.loads),
+        ("l10n message, {} locales".format(args.locales),
+         l10n_message(args.locales), parse_l10n),
+    ]
+    for name in codec.available_backends():
+        codec.use(name)
+        print(name)
+        for title, data, function in payloads:
+            print("    {} ({:.1f} KB): {:.3f}ms".format(
+                title, len(data) / 1024.,
+                bench(function, data, args.runs) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Measures funsize import and worker setup time in fresh interpreters.
+
+Usage: python benchmarks/bench_startup.py [-n RUNS] [--importtime]
+
+--importtime lists the slowest imports with python -X importtime, it is
+ignored before Python 3.7.
+
+The worker setup covers what a worker does before its first message apart
+from network calls: importing the worker, building the queues and bindings
+and compiling the graph template. The time until a running worker starts
+consuming, including connecting to pulse, is logged by the worker itself,
+see the "Listening... (started in ...)" line.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MODULES = ["funsize", "funsize.utils", "funsize.balrog", "funsize.worker",
+           "funsize.scheduler"]
+WORKER_SETUP = """
+from funsize.worker import FunsizeWorker, load_template
+worker = FunsizeWorker(
+    connection=None, queue_name="queue/funsize/funsize",
+    bb_exchange="exchange/build",
+    tc_exchange="exchange/taskcluster-queue/v1/task-completed",
+    balrog_client=None, tc_queue=None, s3_info=None, th_api_root=None,
+    balrog_worker_api_root=None, pvt_key=None)
+worker.queues
+load_template()
+"""
+
+
+def time_code(code, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", code], cwd=ROOT)
+        timings.append(time.time() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def time_import(module, runs):
+    return time_code("import " + module, runs)
+
+
+def slowest_imports(module, count=15):
+    """Returns the slowest cumulative imports reported by -X importtime"""
+    output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=ROOT, stderr=subprocess.STDOUT).decode()
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line.split(":", 1)[1].split("|")
+            rows.append((int(cumulative), name.strip()))
+        except ValueError:
+            continue
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true",
+                        help="show the slowest imports of every module")
+    args = parser.parse_args()
+    if args.importtime and sys.version_info < (3, 7):
+        print("--importtime ignored, python -X importtime needs Python 3.7+")
+        args.importtime = False
+    baseline = time_import("sys", args.runs)
+    print("interpreter startup: {:.3f}s".format(baseline))
+    for module in MODULES:
+        print("import {}: {:.3f}s".format(
+            module, time_import(module, args.runs) - baseline))
+        if args.importtime:
+            for cumulative, name in slowest_imports(module):
+                print("    {:>8.1f}ms {}".format(cumulative / 1000., name))
+    print("worker setup: {:.3f}s".format(
+        time_code(WORKER_SETUP, args.runs) - baseline))
+
+
+if __name__ == "__main__":
+    main()
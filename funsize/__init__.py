@@ -1,3 +1,25 @@
-# flake8: noqa
-from .worker import FunsizeWorker
-from .balrog import BalrogClient
+import importlib
+import sys
+
+# Imported on first access, so importing a light submodule such as
+# funsize.utils does not pull kombu and taskcluster.
+_LAZY = {
+    "FunsizeWorker": "funsize.worker",
+    "BalrogClient": "funsize.balrog",
+}
+__all__ = sorted(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(_LAZY[name]), name)
+    globals()[name] = value
+    return value
+
+
+if sys.version_info < (3, 7):
+    # No module __getattr__ before Python 3.7 (PEP 562)
+    from funsize.worker import FunsizeWorker  # noqa: E402,F401
+    from funsize.balrog import BalrogClient  # noqa: E402,F401
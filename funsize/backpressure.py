@@ -0,0 +1,105 @@
+import logging
+import os
+import re
+import time
+
+log = logging.getLogger(__name__)
+
+# Tasks resolved by funsize itself, they never wait for a worker
+IGNORED_PROVISIONERS = ["null-provisioner"]
+
+
+def template_worker_types(template_file=None):
+    """Returns (provisionerId, workerType) pairs used in the graph template"""
+    if template_file is None:
+        template_file = os.path.join(os.path.dirname(__file__), "tasks",
+                                     "funsize.yml")
+    with open(template_file) as f:
+        template = f.read()
+    worker_types = []
+    for task in re.split(r"^  - taskId:", template, flags=re.MULTILINE)[1:]:
+        provisioner = re.search(r"provisionerId:\s*['\"]?([\w-]+)", task)
+        worker_type = re.search(r"workerType:\s*['\"]?([\w-]+)", task)
+        if not provisioner or not worker_type:
+            continue
+        pair = (provisioner.group(1), worker_type.group(1))
+        if pair[0] not in IGNORED_PROVISIONERS and pair not in worker_types:
+            worker_types.append(pair)
+    return worker_types
+
+
+class BackpressureController(object):
+
+    def __init__(self, tc_queue, worker_types, high_watermark,
+                 low_watermark, interval=60, max_failed_samples=5,
+                 clock=time.time):
+        """Decides when to stop consuming based on pending task counts.
+
+        Consumption pauses when any worker type has at least high_watermark
+        pending tasks and resumes once all of them are at or below
+        low_watermark, so the backlog stays in the pulse queue.
+
+        :type tc_queue: taskcluster.Queue
+        :param worker_types: list of (provisionerId, workerType)
+        :param interval: seconds between pending count samples
+        :param max_failed_samples: consecutive samples missing some pending
+            counts after which a paused consumption resumes anyway, so an
+            API outage does not stop funsize for good
+        """
+        self.tc_queue = tc_queue
+        self.worker_types = worker_types
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.interval = interval
+        self.clock = clock
+        self.paused = False
+        self.max_failed_samples = max_failed_samples
+        self.pending = {}
+        self.failed_samples = 0
+        self.last_sample = None
+
+    def sample(self):
+        """Reads the pending task counts of every worker type, keyed by
+        (provisionerId, workerType) as worker type names are only unique
+        per provisioner.
+
+        Counts that cannot be read are dropped instead of keeping a stale
+        value.
+        """
+        from taskcluster.exceptions import TaskclusterFailure
+        failed = False
+        for provisioner, worker_type in self.worker_types:
+            try:
+                self.pending[(provisioner, worker_type)] = \
+                    self.tc_queue.pendingTasks(
+                        provisioner, worker_type)["pendingTasks"]
+            except TaskclusterFailure:
+                log.exception("Cannot get pending tasks for %s/%s",
+                              provisioner, worker_type)
+                self.pending.pop((provisioner, worker_type), None)
+                failed = True
+        self.failed_samples = self.failed_samples + 1 if failed else 0
+        self.last_sample = self.clock()
+
+    def should_pause(self):
+        """Returns True while consumption should be paused"""
+        if self.last_sample is not None and \
+                self.clock() - self.last_sample < self.interval:
+            return self.paused
+        self.sample()
+        highest = max(self.pending.values()) if self.pending else None
+        if not self.paused:
+            if highest is not None and highest >= self.high_watermark:
+                log.warning("Pausing consumption, pending tasks: %s",
+                            self.pending)
+                self.paused = True
+        elif self.failed_samples >= self.max_failed_samples:
+            log.warning("Resuming consumption, pending tasks unknown for %s "
+                        "samples", self.failed_samples)
+            self.paused = False
+        elif not self.failed_samples and highest <= self.low_watermark:
+            # Resume only when every worker type is known to be low
+            log.info("Resuming consumption, pending tasks: %s",
+                     self.pending)
+            self.paused = False
+        return self.paused
@@ -1,35 +1,88 @@
 import os
-import requests
 import logging
 import json
-import redo
+import heapq
+import time
+
+from funsize.codec import response_json
+from funsize.transport import get_transport
 
 log = logging.getLogger(__name__)
 
-PLATFORM_MAP = json.load(open(
-    os.path.join(os.path.dirname(__file__), 'data', 'platform_map.json')))
+# Balrog update platforms of the platforms funsize serves, the first entry
+# of each platform in data/platform_map.json. Other platforms are looked up
+# in the full map, loaded on first use.
+UPDATE_PLATFORMS = {
+    "linux": "Linux_x86-gcc3",
+    "linux64": "Linux_x86_64-gcc3",
+    "macosx64": "Darwin_x86_64-gcc3-u-i386-x86_64",
+    "win32": "WINNT_x86-msvc",
+    "win64": "WINNT_x86_64-msvc",
+}
+_platform_map = None
 
 
-def _retry_on_http_errors(url, auth, verify, params, errors):
-    for _ in redo.retrier(sleeptime=5, max_sleeptime=30, attempts=10):
-        try:
-            req = requests.get(url, auth=auth, verify=verify, params=params)
-            req.raise_for_status()
-            return req
-        except requests.HTTPError as e:
-            if e.response.status_code in errors:
-                log.exception("Got HTTP %s trying to reach %s",
-                              e.response.status_code, url)
-            else:
-                raise
-    else:
-        raise
+def get_update_platform(platform):
+    """Returns the main Balrog update platform of a build platform"""
+    global _platform_map
+    if platform in UPDATE_PLATFORMS:
+        return UPDATE_PLATFORMS[platform]
+    if _platform_map is None:
+        with open(os.path.join(os.path.dirname(__file__), 'data',
+                               'platform_map.json')) as f:
+            _platform_map = json.load(f)
+    return _platform_map[platform][0]
+
+
+def iter_names(response):
+    """Yields release names from a names_only /releases response.
+
+    The body is parsed incrementally when ijson is installed, so the whole
+    list is never held in memory.
+    """
+    try:
+        import ijson
+    except ImportError:
+        for name in response_json(response)["names"]:
+            yield name
+        return
+    response.raw.decode_content = True
+    for name in ijson.items(response.raw, "names.item"):
+        yield name
+
+
+def previous_months(now, count):
+    """Returns the `count` last months as YYYYMM strings, newest first
+
+    >>> previous_months(time.strptime("20160215", "%Y%m%d"), 3)
+    ['201602', '201601', '201512']
+    """
+    year, month = now.tm_year, now.tm_mon
+    months = []
+    for _ in range(count):
+        months.append("{:04d}{:02d}".format(year, month))
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return months
 
 
 class BalrogClient(object):
 
-    def __init__(self, api_root, auth=None, cert=None):
+    def __init__(self, api_root, auth=None, cert=None, recent_months=3,
+                 clock=time.gmtime, transport=None, first_year=2010):
+        """Balrog admin API client
+
+        :param recent_months: number of months of nightlies looked up one
+            month at a time before falling back to one year at a time
+        :param first_year: oldest year of nightlies looked up
+        :param clock: returns the current UTC time as a struct_time
+        :param transport: funsize.transport.Transport, defaults to the
+            process wide transport
+        """
         self.api_root = api_root
+        self.transport = transport or get_transport()
+        self.recent_months = recent_months
+        self.first_year = first_year
+        self.clock = clock
         if auth:
             self.auth = auth
         else:
@@ -40,38 +93,82 @@ class BalrogClient(object):
         else:
             self.verify = True
 
-    def get_releases(self, product, branch):
-        """Returns a list of release names from Balrog.
+    def get_releases(self, product, branch, limit=None):
+        """Returns a list of release names from Balrog, newest first.
 
         :param product: product name, AKA appName
         :param branch: branch name, e.g. mozilla-central
+        :param limit: maximum number of names to return
         :return: a list of release names
         """
+        return list(self.iter_releases(product, branch, limit))
+
+    def iter_releases(self, product, branch, limit=None):
+        """Yields release names from Balrog, newest first.
+
+        Nightly names end with the build ID, which starts with the build
+        date. Recent months are requested one by one using a narrower
+        name_prefix, so usually only a few dozen names are transferred.
+        If they are not enough, older names are requested one year at a
+        time, back to first_year, the full list is never fetched at once.
+
+        :param product: product name, AKA appName
+        :param branch: branch name, e.g. mozilla-central
+        :param limit: maximum number of names to yield
+        """
+        # Adding -nightly-2 (2 stands for the beginning of build ID
+        # based on date) should filter out release and latest blobs.
+        # This should be changed to -nightly-3 in 3000 ;)
+        prefix = "{}-{}-nightly-".format(product, branch)
+        yielded = 0
+        months = previous_months(self.clock(), self.recent_months)
+        for month in months:
+            names = sorted(self._fetch_names(product, prefix + month),
+                           reverse=True)
+            for name in names:
+                if limit is not None and yielded >= limit:
+                    return
+                yield name
+                yielded += 1
+
+        # Everything older than the recent months, a year at a time
+        oldest = prefix + months[-1]
+        for year in range(int(months[-1][:4]), self.first_year - 1, -1):
+            if limit is not None and yielded >= limit:
+                return
+            older = (n for n in self._fetch_names(product,
+                                                  prefix + str(year))
+                     if n < oldest)
+            if limit is None:
+                names = sorted(older, reverse=True)
+            else:
+                names = heapq.nlargest(limit - yielded, older)
+            for name in names:
+                yield name
+                yielded += 1
+
+    def _fetch_names(self, product, name_prefix):
         url = "{}/releases".format(self.api_root)
         params = {
             "product": product,
-            # Adding -nightly-2 (2 stands for the beginning of build ID
-            # based on date) should filter out release and latest blobs.
-            # This should be changed to -nightly-3 in 3000 ;)
-            "name_prefix": "{}-{}-nightly-2".format(product, branch),
+            "name_prefix": name_prefix,
             "names_only": True
         }
         params_str = "&".join("=".join([k, str(v)])
-                              for k, v in params.iteritems())
+                              for k, v in sorted(params.items()))
         log.info("Connecting to %s?%s", url, params_str)
-        req = _retry_on_http_errors(
-            url=url, auth=self.auth, verify=self.verify, params=params,
-            errors=[500])
-        releases = req.json()["names"]
-        releases = sorted(releases, reverse=True)
-        return releases
+        return iter_names(self._get(url, params=params, stream=True))
 
     def get_build(self, release, platform, locale):
-        update_platform = PLATFORM_MAP[platform][0]
+        update_platform = get_update_platform(platform)
         url = "{}/releases/{}/builds/{}/{}".format(self.api_root, release,
                                                    update_platform, locale)
         log.info("Connecting to %s", url)
-        req = _retry_on_http_errors(
-            url=url, auth=self.auth, verify=self.verify, params=None,
-            errors=[500])
-        return req.json()
+        return response_json(self._get(url))
+
+    def _get(self, url, params=None, stream=False):
+        """GET using the shared transport, which retries server errors"""
+        req = self.transport.get(url, auth=self.auth, verify=self.verify,
+                                 params=params, stream=stream)
+        req.raise_for_status()
+        return req
@@ -0,0 +1,115 @@
+import logging
+import re
+from collections import OrderedDict
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+log = logging.getLogger(__name__)
+
+# AMQP topic wildcards match whole dot separated words only, so a pattern
+# like "build.{branch}-{platform}-l10n-nightly*.*.finished" cannot be
+# expressed. All buildbot bindings collapse into this single one instead.
+BB_WILDCARD = "build.*.*.finished"
+
+
+def topic_regex(routing_keys):
+    """Compiles AMQP topic binding patterns into a single regex.
+
+    "*" matches exactly one word, "#" matches zero or more words.
+
+    >>> topic_regex(["build.*.finished"]).match("build.x.finished") is None
+    False
+    >>> topic_regex(["build.*.finished"]).match("build.x.y.finished") is None
+    True
+    """
+    patterns = []
+    for key in routing_keys:
+        words = []
+        for word in key.split("."):
+            if word == "*":
+                words.append(r"[^.]+")
+            elif word == "#":
+                words.append(r".*")
+            else:
+                words.append(re.escape(word))
+        patterns.append(r"\.".join(words))
+    return re.compile(r"^(?:{})$".format("|".join(patterns)))
+
+
+def plan_bindings(shard_bindings, bb_exchange, tc_exchange, compact=False):
+    """Builds the desired binding set per queue.
+
+    :param shard_bindings: OrderedDict of {queue name: {"bb": [keys],
+        "tc": [keys]}}
+    :param compact: replace the explicit buildbot bindings with
+        BB_WILDCARD. Only possible when a single queue gets buildbot
+        bindings, otherwise every shard queue would get every message.
+    :return: OrderedDict of {queue name: [(exchange name, routing key)]}
+    """
+    bb_queues = [name for name, b in shard_bindings.items() if b["bb"]]
+    if compact and len(bb_queues) > 1:
+        log.warning("Cannot compact buildbot bindings split across %s "
+                    "queues, using explicit bindings", len(bb_queues))
+        compact = False
+    plan = OrderedDict()
+    for queue_name, bindings in shard_bindings.items():
+        bb_keys = bindings["bb"]
+        if compact and bb_keys:
+            bb_keys = [BB_WILDCARD]
+        plan[queue_name] = [(bb_exchange, k) for k in bb_keys] + \
+            [(tc_exchange, k) for k in bindings["tc"]]
+    return plan
+
+
+class BindingsAPI(object):
+
+    def __init__(self, api_root, auth, vhost="/"):
+        """Reads existing queue bindings from the RabbitMQ management API
+
+        :param api_root: management API root, e.g. https://host/api
+        :param auth: (user, password) tuple
+        """
+        self.api_root = api_root
+        self.auth = auth
+        self.vhost = vhost
+
+    def get(self, queue_name):
+        """Returns a set of (exchange name, routing key) bound to a queue"""
+        from funsize.codec import response_json
+        from funsize.transport import get_transport
+        url = "{}/queues/{}/{}/bindings".format(
+            self.api_root, quote(self.vhost, safe=""),
+            quote(queue_name, safe=""))
+        req = get_transport().get(url, auth=self.auth)
+        if req.status_code == 404:
+            # The queue has not been created yet
+            return set()
+        req.raise_for_status()
+        # The default exchange ("") binding is implicit and cannot be removed
+        return set((b["source"], b["routing_key"])
+                   for b in response_json(req) if b["source"])
+
+
+def reconcile(channel, queue_name, desired, existing):
+    """Declares a queue and applies only the binding delta.
+
+    :param desired: set of (exchange name, routing key)
+    :param existing: set of (exchange name, routing key) already bound
+    :return: a kombu.Queue without bindings, suitable for consuming
+    """
+    from kombu import Queue
+    queue = Queue(name=queue_name, durable=True, exclusive=False,
+                  auto_delete=False, channel=channel)
+    queue.declare()
+    added = sorted(set(desired) - existing)
+    removed = sorted(existing - set(desired))
+    for exchange, routing_key in added:
+        queue.bind_to(exchange=exchange, routing_key=routing_key)
+    for exchange, routing_key in removed:
+        queue.unbind_from(exchange=exchange, routing_key=routing_key)
+    log.info("Queue %s: %s bindings added, %s removed, %s unchanged",
+             queue_name, len(added), len(removed),
+             len(set(desired) & existing))
+    return queue
@@ -0,0 +1,109 @@
+import importlib
+import logging
+
+log = logging.getLogger(__name__)
+
+# Tried in order, the first importable one is used. All but the stdlib
+# module parse in C.
+BACKENDS = ["orjson", "ujson", "simplejson", "json"]
+CONTENT_TYPE = "application/json"
+
+
+def _orjson(module):
+    def dumps(obj):
+        return module.dumps(obj).decode("utf-8")
+    return module.loads, dumps
+
+
+def _ujson(module):
+    def dumps(obj):
+        return module.dumps(obj, escape_forward_slashes=False)
+    return module.loads, dumps
+
+
+def _default(module):
+    return module.loads, module.dumps
+
+
+ADAPTERS = {
+    "orjson": _orjson,
+    "ujson": _ujson,
+}
+
+
+def load_backend(name):
+    """Returns the (loads, dumps) functions of a JSON module
+
+    :raises ImportError: if the module is not installed
+    """
+    module = importlib.import_module(name)
+    return ADAPTERS.get(name, _default)(module)
+
+
+def available_backends():
+    """Names of the installed backends, in order of preference"""
+    names = []
+    for name in BACKENDS:
+        try:
+            load_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+backend = None
+_loads = _dumps = None
+
+
+def use(name=None):
+    """Selects the backend used by loads() and dumps().
+
+    :param name: one of BACKENDS, the fastest installed one by default
+    :raises ImportError: if the requested backend is not installed
+    """
+    global backend, _loads, _dumps
+    if name is None:
+        name = available_backends()[0]
+    _loads, _dumps = load_backend(name)
+    backend = name
+    log.debug("Using %s to parse JSON", name)
+
+
+def loads(data):
+    """Parses a JSON document from str or bytes
+
+    >>> loads(b'[1, 2.5, null]')
+    [1, 2.5, None]
+    """
+    if _loads is None:
+        use()
+    return _loads(data)
+
+
+def dumps(obj):
+    """Serializes to a JSON str"""
+    if _dumps is None:
+        use()
+    return _dumps(obj)
+
+
+def response_json(response):
+    """Parses the body of a requests.Response, in place of response.json()
+
+    The body is decoded as UTF-8, as JSON responses are, instead of the
+    charset detection requests falls back to.
+    """
+    return loads(response.content)
+
+
+def register_kombu():
+    """Makes kombu encode and decode JSON messages with this codec.
+
+    Pulse bodies are decoded by the "json" serializer of kombu, registering
+    under the same name and content type replaces it, so consumers accepting
+    ["json"] go through loads().
+    """
+    from kombu.serialization import register
+    register("json", dumps, loads, content_type=CONTENT_TYPE,
+             content_encoding="utf-8")
@@ -0,0 +1,158 @@
+import datetime
+import hashlib
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+def partial_key(from_mar, to_mar, locale):
+    """Content address of a partial, usable as an index namespace component"""
+    key = u"|".join([from_mar, to_mar, locale]).encode("utf-8")
+    return hashlib.sha1(key).hexdigest()
+
+
+def partials_namespace(branch, platform, revision):
+    """Index namespace of the partials generated for a "to" build. Every
+    partial is indexed under `<namespace>.<partial key>` by the Balrog
+    submission task of its graph, see tasks/funsize.yml.
+    """
+    return "funsize.v1.{}.partials.{}.{}".format(branch, platform, revision)
+
+
+def in_flight_namespace(branch, platform, revision):
+    """Index namespace of the partials submitted but not generated yet.
+    Every worker inserts the partials it submits under
+    `<namespace>.<partial key>`, with a short expiration.
+    """
+    return "funsize.v1.{}.in-flight.{}.{}".format(branch, platform, revision)
+
+
+class PartialsIndex(object):
+
+    def __init__(self, tc_index=None, in_flight_ttl=4 * 3600,
+                 shared=True, clock=time.time):
+        """Finds partials that were already generated or are in flight.
+
+        Generated partials are read from the Taskcluster index, which is
+        populated when the Balrog submission task completes. Partials
+        planned by this process are remembered for `in_flight_ttl` seconds,
+        to cover the time before they are indexed. With `shared`, submitted
+        partials are also inserted in the index for `in_flight_ttl`
+        seconds, so other workers skip them too.
+
+        :type tc_index: taskcluster.Index
+        :param in_flight_ttl: seconds to remember submitted partials
+        :param shared: share the in flight partials through the index, needs
+            the index:insert-task:funsize.v1.* scope
+        """
+        self.tc_index = tc_index
+        self.in_flight_ttl = in_flight_ttl
+        self.shared = shared
+        self.clock = clock
+        self.in_flight = {}
+
+    def list_tasks(self, namespace):
+        """Returns the tasks indexed under a namespace, [] on failures.
+
+        All tasks of a "to" build are fetched with one paginated listing
+        instead of a lookup per partial.
+        """
+        from taskcluster.exceptions import TaskclusterFailure
+        tasks = []
+        if not self.tc_index:
+            return tasks
+        payload = {}
+        try:
+            while True:
+                result = self.tc_index.listTasks(namespace, payload)
+                tasks.extend(result["tasks"])
+                if not result.get("continuationToken"):
+                    break
+                payload = {"continuationToken": result["continuationToken"]}
+        except TaskclusterFailure:
+            log.exception("Cannot list %s, skipping the index check",
+                          namespace)
+        return tasks
+
+    def indexed(self, namespace):
+        """Returns the partial keys indexed under a namespace"""
+        return set(t["namespace"].rsplit(".", 1)[-1]
+                   for t in self.list_tasks(namespace))
+
+    def in_flight_elsewhere(self, namespace):
+        """Returns the partial keys submitted by any worker and not expired.
+
+        The index drops expired entries lazily, the expiration is also kept
+        in the entry data.
+        """
+        now = self.clock()
+        return set(t["namespace"].rsplit(".", 1)[-1]
+                   for t in self.list_tasks(namespace)
+                   if (t.get("data") or {}).get("expires", 0) > now)
+
+    def _expire(self):
+        now = self.clock()
+        for key, expires in list(self.in_flight.items()):
+            if expires <= now:
+                del self.in_flight[key]
+
+    def filter_new(self, branch, platform, revision, tasks):
+        """Drops partials that were already generated or are in flight and
+        marks the remaining ones as in flight.
+
+        :param tasks: {update_number: [{"locale", "from_mar", "to_mar"}]}
+        :return: filtered tasks in the same format
+        """
+        self._expire()
+        indexed = self.indexed(partials_namespace(branch, platform, revision))
+        if self.shared:
+            indexed |= self.in_flight_elsewhere(
+                in_flight_namespace(branch, platform, revision))
+        expires = self.clock() + self.in_flight_ttl
+        new_tasks = {}
+        for update_number, extras in tasks.items():
+            for e in extras:
+                key = partial_key(e["from_mar"], e["to_mar"], e["locale"])
+                if key in indexed or key in self.in_flight:
+                    log.info("Skipping existing partial %s -> %s (%s)",
+                             e["from_mar"], e["to_mar"], e["locale"])
+                    continue
+                self.in_flight[key] = expires
+                new_tasks.setdefault(update_number, []).append(e)
+        return new_tasks
+
+    def mark_submitted(self, branch, platform, revision, extras, task_id):
+        """Inserts submitted partials in the shared in flight namespace.
+
+        Failures are logged only, the partials are still remembered by this
+        process.
+
+        :param task_id: a task of the submitted graph
+        """
+        from taskcluster import stringDate
+        from taskcluster.exceptions import TaskclusterFailure
+        if not (self.shared and self.tc_index):
+            return
+        expires = self.clock() + self.in_flight_ttl
+        payload = {
+            "taskId": task_id,
+            "rank": 0,
+            "data": {"expires": expires},
+            "expires": stringDate(datetime.datetime.utcfromtimestamp(expires)),
+        }
+        namespace = in_flight_namespace(branch, platform, revision)
+        for e in extras:
+            key = partial_key(e["from_mar"], e["to_mar"], e["locale"])
+            try:
+                self.tc_index.insertTask("{}.{}".format(namespace, key),
+                                         payload)
+            except TaskclusterFailure:
+                log.exception("Cannot mark %s as in flight", key)
+
+    def forget(self, extras):
+        """Removes partials from the in flight set, e.g. when their
+        submission failed."""
+        for e in extras:
+            self.in_flight.pop(
+                partial_key(e["from_mar"], e["to_mar"], e["locale"]), None)
@@ -0,0 +1,230 @@
+import calendar
+import logging
+import os
+import socket
+import time
+from collections import OrderedDict, defaultdict, deque
+
+log = logging.getLogger(__name__)
+
+# Graph tasks followed by the tracker, by worker type
+WORKER_TYPE_KINDS = {
+    "funsize-mar-generator": "generator",
+    "signing-worker-v1": "signing",
+    "funsize-balrog": "balrog",
+}
+# funsize: pulse message to graph submission
+# queue: graph submission to generator start
+# generator, signing, balrog: end of the previous task to end of this one
+# total: pulse message to partials in Balrog
+STAGES = ["funsize", "queue", "generator", "signing", "balrog", "total"]
+
+
+def parse_time(value):
+    """Seconds since the epoch of an ISO 8601 UTC timestamp
+
+    >>> parse_time("2016-10-19T12:00:01.500Z")
+    1476878401.5
+    >>> parse_time("2016-10-19T12:00:01+0000")
+    1476878401.0
+    """
+    seconds = calendar.timegm(time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S"))
+    fraction = 0.0
+    if value[19:20] == ".":
+        digits = value[20:].rstrip("Z").split("+")[0].split("-")[0]
+        if digits:
+            fraction = float("0." + digits)
+    return seconds + fraction
+
+
+def published_at(body, message):
+    """Time the build behind a pulse message finished, None if unknown.
+
+    Buildbot messages carry the time they were sent, Taskcluster messages
+    the resolution time of the signing task run.
+    """
+    try:
+        if isinstance(body, dict) and "_meta" in body:
+            return parse_time(body["_meta"]["sent"])
+        status = message.payload["status"]
+        run = status["runs"][message.payload.get("runId", -1)]
+        return parse_time(run["resolved"])
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+        return None
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of a sorted list
+
+    >>> percentile([1, 2, 3, 4], 0.5)
+    2
+    """
+    index = max(int(round(fraction * len(values))) - 1, 0)
+    return values[index]
+
+
+class LatencyTracker(object):
+
+    def __init__(self, queue_prefix, exchanges,
+                 routing_key="route.index.funsize.v1.#", report_interval=600,
+                 max_samples=1000, max_groups=10000, cost_model=None,
+                 clock=time.time):
+        """Follows submitted graphs to the end of their Balrog task.
+
+        The tracker consumes the task-completed and task-failed messages of
+        the funsize routes from its own exclusive queue, keeps the
+        resolution times of the generator, signing and Balrog tasks of the
+        graphs submitted by this process, and logs latency percentiles per
+        stage, branch and platform every `report_interval` seconds.
+
+        :param queue_prefix: queue/<user>/<name>, the host name and pid are
+            appended so every process sees every message
+        :param exchanges: task-completed and task-failed exchange names
+        :param max_samples: latencies kept per stage, branch and platform
+        :param max_groups: graphs followed at once, the oldest are dropped
+        :param cost_model: funsize.packing.CostModel fed with the observed
+            generator runtimes
+        """
+        self.queue_name = "{}-{}-{}".format(queue_prefix,
+                                            socket.gethostname(), os.getpid())
+        self.exchanges = exchanges
+        self.routing_key = routing_key
+        self.report_interval = report_interval
+        self.max_samples = max_samples
+        self.max_groups = max_groups
+        self.cost_model = cost_model
+        self.clock = clock
+        self.groups = OrderedDict()
+        self.tasks = {}
+        self.samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self.failures = defaultdict(int)
+        self.last_report = clock()
+
+    def queue(self):
+        from kombu import Exchange, Queue, binding
+        bindings = [binding(Exchange(name, type="topic", passive=True),
+                            routing_key=self.routing_key)
+                    for name in self.exchanges]
+        return Queue(name=self.queue_name, bindings=bindings, durable=False,
+                     exclusive=True, auto_delete=True)
+
+    def submitted(self, task_group_id, tasks, branch, platform,
+                  update_number, extra, published_at=None):
+        """Starts following a submitted graph
+
+        :param tasks: the "tasks" list of the graph definition
+        :param published_at: time of the pulse message, see published_at()
+        """
+        now = self.clock()
+        group = {
+            "branch": branch,
+            "platform": platform,
+            "update_number": update_number,
+            "extra": extra,
+            "published_at": published_at,
+            "submitted_at": now,
+            "resolved": {},
+            "tasks": [],
+        }
+        for t in tasks:
+            kind = WORKER_TYPE_KINDS.get(t["task"].get("workerType"))
+            if kind:
+                self.tasks[t["taskId"]] = (task_group_id, kind)
+                group["tasks"].append(t["taskId"])
+        self.groups[task_group_id] = group
+        if published_at is not None:
+            self.observe("funsize", group, now - published_at)
+        while len(self.groups) > self.max_groups:
+            self.drop(next(iter(self.groups)))
+
+    def drop(self, task_group_id):
+        group = self.groups.pop(task_group_id, None)
+        for task_id in group["tasks"] if group else []:
+            self.tasks.pop(task_id, None)
+
+    def observe(self, stage, group, seconds):
+        self.samples[(stage, group["branch"], group["platform"])].append(
+            max(seconds, 0))
+
+    def process_message(self, body, message):
+        """Callback of the tracker queue consumer"""
+        try:
+            self.task_resolved(message.payload)
+        except Exception:
+            log.exception("Cannot track task resolution")
+        finally:
+            message.ack()
+
+    def task_resolved(self, payload):
+        status = payload["status"]
+        task = self.tasks.pop(status["taskId"], None)
+        if task is None:
+            return
+        task_group_id, kind = task
+        group = self.groups.get(task_group_id)
+        if group is None:
+            return
+        run = status["runs"][payload.get("runId", -1)]
+        if run["state"] != "completed":
+            log.warning("%s task %s of %s %s %s", kind, status["taskId"],
+                        group["branch"], group["platform"], run["state"])
+            self.failures[(kind, group["branch"], group["platform"])] += 1
+            self.drop(task_group_id)
+            return
+        started = parse_time(run["started"])
+        resolved = parse_time(run["resolved"])
+        group["resolved"][kind] = resolved
+        if kind == "generator":
+            self.observe("queue", group, started - group["submitted_at"])
+            self.observe("generator", group, resolved - started)
+            self.record_cost(group, resolved - started)
+        elif kind == "signing" and "generator" in group["resolved"]:
+            self.observe("signing", group,
+                         resolved - group["resolved"]["generator"])
+        elif kind == "balrog":
+            if "signing" in group["resolved"]:
+                self.observe("balrog", group,
+                             resolved - group["resolved"]["signing"])
+            if group["published_at"] is not None:
+                self.observe("total", group,
+                             resolved - group["published_at"])
+            self.drop(task_group_id)
+
+    def record_cost(self, group, duration):
+        """Feeds the generator runtime of a graph to the cost model.
+
+        Only the MAR sizes already known from packing are used, nothing is
+        fetched on the consumer thread. Graphs with an unknown size are not
+        recorded.
+        """
+        from funsize.packing import MB
+        if not self.cost_model:
+            return
+        sizes = [self.cost_model.cached_size(url) for e in group["extra"]
+                 for url in (e["from_mar"], e["to_mar"])]
+        if not sizes or None in sizes:
+            log.debug("Unknown MAR sizes, not recording the cost")
+            return
+        mbs = sum(sizes) / float(MB)
+        self.cost_model.record(group["platform"], group["update_number"],
+                               mbs, duration, partials=len(group["extra"]))
+
+    def maybe_report(self):
+        if self.clock() - self.last_report >= self.report_interval:
+            self.report()
+
+    def report(self):
+        """Logs the latency distributions and failures"""
+        self.last_report = self.clock()
+        for (stage, branch, platform), values in sorted(
+                self.samples.items(),
+                key=lambda i: (i[0][1], i[0][2], STAGES.index(i[0][0]))):
+            values = sorted(values)
+            log.info("Latency %s/%s %s: n=%s p50=%.0fs p90=%.0fs max=%.0fs",
+                     branch, platform, stage, len(values),
+                     percentile(values, 0.5), percentile(values, 0.9),
+                     values[-1])
+        for (kind, branch, platform), count in sorted(self.failures.items()):
+            log.info("Failed %s tasks %s/%s: %s", kind, branch, platform,
+                     count)
+        log.info("Following %s graphs", len(self.groups))
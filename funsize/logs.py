@@ -0,0 +1,130 @@
+import logging
+import time
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    try:
+        # Python 2 backport
+        from logutils.queue import QueueHandler, QueueListener
+    except ImportError:
+        QueueHandler = QueueListener = None
+
+log = logging.getLogger(__name__)
+
+
+def format_fields(**fields):
+    """Compact key=value rendering of a structured log record
+
+    >>> format_fields(branch="oak", locales=3, error=None)
+    'branch=oak error=- locales=3'
+    """
+    return " ".join("{}={}".format(k, "-" if v is None else v)
+                    for k, v in sorted(fields.items()))
+
+
+class RateLimitFilter(logging.Filter):
+
+    def __init__(self, burst=20, interval=60, level=logging.INFO,
+                 clock=time.time):
+        """Lets through at most `burst` records of the same call site per
+        `interval` seconds.
+
+        Records are grouped by logger and message template, so per locale
+        lines such as "Build from: %s" are limited while one-off lines pass.
+        Records above `level` and records logged with
+        extra={"rate_limit": False} are never dropped. The first record of a
+        new window reports how many were dropped in the previous one.
+        """
+        logging.Filter.__init__(self)
+        self.burst = burst
+        self.interval = interval
+        self.level = level
+        self.clock = clock
+        self.windows = {}
+
+    def filter(self, record):
+        if record.levelno > self.level or \
+                not getattr(record, "rate_limit", True):
+            return True
+        key = (record.name, record.msg)
+        now = self.clock()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            self.windows[key] = [now, 1, 0]
+            if suppressed and isinstance(record.args, tuple):
+                record.msg = "{} (%s similar messages suppressed)".format(
+                    record.msg)
+                record.args = record.args + (suppressed,)
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+if QueueHandler is not None:
+    class DeferredQueueHandler(QueueHandler):
+
+        def prepare(self, record):
+            """Leaves the formatting to the listener thread.
+
+            Only the traceback is rendered here, the frames it refers to do
+            not outlive the call. Arguments are formatted later, they must
+            not be mutated after being logged.
+            """
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+                record.exc_info = None
+            return record
+
+
+def start_async_logging(burst=20, interval=60):
+    """Moves the handlers of the root logger behind a queue emptied by a
+    background thread, and rate limits repetitive INFO and DEBUG records.
+
+    Threads do not survive a fork, so every worker process calls this on its
+    own.
+
+    :return: the QueueListener to stop before exiting, None if the queue
+        handlers are not available and logging stays synchronous
+    """
+    root = logging.getLogger()
+    rate_limit = RateLimitFilter(burst=burst, interval=interval)
+    if QueueHandler is None:
+        log.warning("QueueHandler not available, logging synchronously")
+        for handler in root.handlers:
+            handler.addFilter(rate_limit)
+        return None
+    handlers = root.handlers[:]
+    queue = Queue(-1)
+    queue_handler = DeferredQueueHandler(queue)
+    queue_handler.addFilter(rate_limit)
+    try:
+        listener = QueueListener(queue, *handlers,
+                                 respect_handler_level=True)
+    except TypeError:
+        listener = QueueListener(queue, *handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    listener.start()
+    return listener
+
+
+def stop_async_logging(listener):
+    """Flushes the queued records and restores synchronous logging"""
+    if listener is None:
+        return
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    listener.stop()
+    for handler in listener.handlers:
+        root.addHandler(handler)
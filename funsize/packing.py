@@ -0,0 +1,169 @@
+import logging
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+DEFAULT_LIMITS = {
+    # number of "from" builds per locale
+    "partial_limit": 4,
+    # maximum number of partials per generator task
+    "per_chunk": 5,
+    # number of most recent Balrog releases looked at for "from" builds, not
+    # every release has every platform and locale
+    "release_limit": 20,
+    # runtime in seconds to aim at when packing partials into tasks, the
+    # partials are packed using per_chunk only if set to null
+    "target_runtime": 1800,
+    # plan and submit partials per_chunk at a time while the "from" builds
+    # of the other locales are looked up, packing by target_runtime applies
+    # only to the last incomplete chunks then
+    "streaming": False,
+}
+
+
+def get_limits(limits_config, branch, platform):
+    """Returns the partial limits of a branch and platform.
+
+    Later sections override earlier ones: "default", "<platform>",
+    "<branch>" and "<branch>/<platform>".
+    """
+    limits = dict(DEFAULT_LIMITS)
+    limits_config = limits_config or {}
+    for section in ("default", platform, branch,
+                    "{}/{}".format(branch, platform)):
+        limits.update(limits_config.get(section) or {})
+    return limits
+
+
+class CostModel(object):
+
+    def __init__(self, overhead=60, seconds_per_mb=2.0, default_size=60 * MB,
+                 update_number_factor=0.1, smoothing=0.2, max_cached=2048,
+                 probe_timeout=5, failure_ttl=600, clock=time.time):
+        """Estimates the runtime of generating a partial.
+
+        The runtime is modelled as a fixed overhead plus a per platform cost
+        per MB of "from" and "to" MAR, increased for older "from" builds.
+        The per platform cost is adjusted with the observed durations.
+
+        :param overhead: fixed seconds per partial
+        :param seconds_per_mb: initial cost per MB of MAR for any platform
+        :param default_size: size assumed when a MAR size is unknown
+        :param update_number_factor: relative cost increase per update
+            number, older builds are more different from the "to" build
+        :param smoothing: weight of a new observation of the cost per MB
+        :param max_cached: number of MAR sizes to remember
+        :param probe_timeout: seconds to wait for a MAR size HEAD request,
+            which is not retried
+        :param failure_ttl: seconds before a failed size lookup is retried
+        """
+        self.overhead = overhead
+        self.seconds_per_mb = seconds_per_mb
+        self.default_size = default_size
+        self.update_number_factor = update_number_factor
+        self.smoothing = smoothing
+        self.max_cached = max_cached
+        self.probe_timeout = probe_timeout
+        self.failure_ttl = failure_ttl
+        self.clock = clock
+        self.platform_seconds_per_mb = {}
+        self._sizes = OrderedDict()
+        self._failures = OrderedDict()
+
+    @staticmethod
+    def _remember(cache, url, value, max_cached):
+        cache[url] = value
+        if len(cache) > max_cached:
+            cache.popitem(last=False)
+
+    def set_size(self, url, size):
+        """Remembers a MAR size known from elsewhere, e.g. the filesize of
+        a Balrog build, so it is not requested
+        """
+        self._failures.pop(url, None)
+        self._remember(self._sizes, url, size, self.max_cached)
+
+    def cached_size(self, url):
+        """Returns the size of a MAR file if already known, None otherwise"""
+        return self._sizes.get(url)
+
+    def mar_size(self, url):
+        """Returns the size of a MAR file, using a HEAD request if unknown.
+
+        The request is a single attempt with probe_timeout. A failed lookup
+        is answered with default_size for failure_ttl seconds, so a missing
+        MAR is not requested again for every locale and update number.
+        """
+        import requests
+        from funsize.transport import get_transport
+        if url in self._sizes:
+            return self._sizes[url]
+        failed_at = self._failures.get(url)
+        if failed_at is not None and \
+                self.clock() - failed_at < self.failure_ttl:
+            return self.default_size
+        try:
+            req = get_transport().probe(url, timeout=self.probe_timeout)
+            req.raise_for_status()
+            size = int(req.headers["Content-Length"])
+        except (requests.RequestException, KeyError, ValueError) as excp:
+            log.debug("Cannot get size of %s: %s", url, excp)
+            self._remember(self._failures, url, self.clock(),
+                           self.max_cached)
+            return self.default_size
+        self.set_size(url, size)
+        return size
+
+    def estimate(self, platform, update_number, from_mar, to_mar):
+        """Estimated runtime of a partial in seconds"""
+        mbs = float(self.mar_size(from_mar) + self.mar_size(to_mar)) / MB
+        rate = self.platform_seconds_per_mb.get(platform,
+                                                self.seconds_per_mb)
+        age = 1 + self.update_number_factor * (update_number - 1)
+        return self.overhead + rate * mbs * age
+
+    def record(self, platform, update_number, mbs, duration, partials=1):
+        """Adjusts the cost per MB of a platform with an observed duration
+
+        :param mbs: total MB of the "from" and "to" MARs of the task
+        :param duration: observed task runtime in seconds
+        :param partials: number of partials generated by the task
+        """
+        if mbs <= 0:
+            return
+        age = 1 + self.update_number_factor * (update_number - 1)
+        observed = max(duration - self.overhead * partials, 0) / (mbs * age)
+        current = self.platform_seconds_per_mb.get(platform,
+                                                   self.seconds_per_mb)
+        self.platform_seconds_per_mb[platform] = \
+            (1 - self.smoothing) * current + self.smoothing * observed
+
+
+def pack(items, costs, target_runtime, per_chunk):
+    """Packs items into chunks using first fit decreasing.
+
+    Chunks are filled up to target_runtime total cost and per_chunk items.
+    An item costing more than the target gets its own chunk.
+
+    >>> pack("abcd", [4, 3, 2, 1], target_runtime=5, per_chunk=5)
+    [['a', 'd'], ['b', 'c']]
+
+    :param items: items to pack
+    :param costs: estimated cost of every item
+    :return: list of chunks, each chunk a list of items in input order
+    """
+    order = sorted(range(len(items)), key=lambda i: costs[i], reverse=True)
+    chunks = []
+    for i in order:
+        for chunk in chunks:
+            if len(chunk["items"]) < per_chunk and \
+                    chunk["cost"] + costs[i] <= target_runtime:
+                break
+        else:
+            chunk = {"items": [], "cost": 0}
+            chunks.append(chunk)
+        chunk["items"].append(i)
+        chunk["cost"] += costs[i]
+    return [[items[i] for i in sorted(chunk["items"])] for chunk in chunks]
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class BalrogStore(object):
+
+    def __init__(self, ttl=1800, negative_ttl=60, clock=time.time):
+        """Local store of Balrog release names and build blobs.
+
+        Filled by the prefetcher and by the lookups of the worker, entries
+        older than `ttl` seconds are ignored. Missing builds are stored as
+        None for `negative_ttl` seconds only, so a build published after the
+        lookup is found soon.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._releases = {}
+        self._builds = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, entry):
+        if entry is None:
+            return False
+        ttl = self.ttl if entry[1] is not None else self.negative_ttl
+        return self.clock() - entry[0] < ttl
+
+    def releases(self, product, branch):
+        """Returns the newest release names, None if unknown"""
+        entry = self._releases.get((product, branch))
+        return entry[1] if self._fresh(entry) else None
+
+    def set_releases(self, product, branch, names):
+        with self._lock:
+            self._releases[(product, branch)] = (self.clock(), list(names))
+
+    def build(self, release, platform, locale):
+        """Returns (found, blob), blob is None for missing builds"""
+        entry = self._builds.get((release, platform, locale))
+        if not self._fresh(entry):
+            return False, None
+        return True, entry[1]
+
+    def set_build(self, release, platform, locale, blob):
+        with self._lock:
+            self._builds[(release, platform, locale)] = (self.clock(), blob)
+
+    def expire(self):
+        """Drops the entries older than ttl"""
+        with self._lock:
+            for entries in (self._releases, self._builds):
+                for key, entry in list(entries.items()):
+                    if not self._fresh(entry):
+                        del entries[key]
+
+
+class BalrogPrefetcher(object):
+
+    def __init__(self, balrog_client, store, products, branches, platforms,
+                 locales, release_limit=20, interval=600):
+        """Refreshes the store in a background thread.
+
+        Every `interval` seconds the newest `release_limit` release names of
+        every product and branch are fetched, then their builds for every
+        platform and locale, so the "from" build lookups of the next
+        messages are served locally.
+
+        :type balrog_client: funsize.balrog.BalrogClient
+        :type store: BalrogStore
+        """
+        self.balrog_client = balrog_client
+        self.store = store
+        self.products = products
+        self.branches = branches
+        self.platforms = platforms
+        self.locales = locales
+        self.release_limit = release_limit
+        self.interval = interval
+        self.running = False
+
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self._run,
+                                  name="funsize-balrog-prefetcher")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            started = time.time()
+            try:
+                self.refresh()
+            except Exception:
+                log.exception("Balrog prefetch failed")
+            log.info("Prefetched Balrog data in %.1fs", time.time() - started)
+            time.sleep(max(self.interval - (time.time() - started), 0))
+
+    def refresh(self):
+        import requests
+        self.store.expire()
+        for product in self.products:
+            for branch in self.branches:
+                if not self.running:
+                    return
+                try:
+                    names = self.balrog_client.get_releases(
+                        product, branch, limit=self.release_limit)
+                except requests.RequestException:
+                    log.exception("Cannot prefetch %s %s releases", product,
+                                  branch)
+                    continue
+                self.store.set_releases(product, branch, names)
+                for release in names:
+                    for platform in self.platforms:
+                        for locale in self.locales:
+                            self.fetch_build(release, platform, locale)
+
+    def fetch_build(self, release, platform, locale):
+        """Fetches a build into the store, unless it is already there"""
+        import requests
+        found, _ = self.store.build(release, platform, locale)
+        if found:
+            return
+        try:
+            blob = self.balrog_client.get_build(release, platform, locale)
+        except requests.HTTPError as excp:
+            if excp.response is None or excp.response.status_code != 404:
+                log.debug("Cannot prefetch %s/%s/%s: %s", release, platform,
+                          locale, excp)
+                return
+            blob = None
+        except requests.RequestException as excp:
+            log.debug("Cannot prefetch %s/%s/%s: %s", release, platform,
+                      locale, excp)
+            return
+        self.store.set_build(release, platform, locale, blob)
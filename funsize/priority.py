@@ -0,0 +1,80 @@
+import heapq
+import itertools
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# The only defaults, config/default.yml overrides them
+DEFAULT_BRANCH_PRIORITIES = {
+    "mozilla-central": 0,
+    "mozilla-aurora": 10,
+    "default": 20,
+}
+DEFAULT_LOCALE_PRIORITIES = {
+    "en-US": 0,
+    "l10n": 30,
+}
+
+
+def locale_class(locales):
+    """Returns "en-US" for chunks containing en-US, "l10n" otherwise"""
+    if "en-US" in locales:
+        return "en-US"
+    return "l10n"
+
+
+class PriorityScheduler(object):
+
+    def __init__(self, branches=None, locales=None, update_number=10,
+                 aging=0.1, clock=time.time):
+        """Orders planned task graphs before submission.
+
+        Priorities are numbers, lower values are submitted first. The
+        priority of a graph is the sum of its branch, locale class and
+        update number components. Waiting graphs gain `aging` points per
+        second, so low priority work is not starved.
+
+        :param branches: {branch: priority}, "default" for other branches
+        :param locales: {"en-US" or "l10n": priority}
+        :param update_number: priority added per update number after the
+            first one
+        :param aging: priority points gained per second of waiting
+        :param clock: time source, used by tests
+        """
+        self.branches = dict(DEFAULT_BRANCH_PRIORITIES)
+        self.branches.update(branches or {})
+        self.locales = dict(DEFAULT_LOCALE_PRIORITIES)
+        self.locales.update(locales or {})
+        self.update_number = update_number
+        self.aging = aging
+        self.clock = clock
+        self._heap = []
+        self._counter = itertools.count()
+
+    def priority(self, branch, locales, update_number):
+        branch_priority = self.branches.get(branch,
+                                            self.branches["default"])
+        locale_priority = self.locales[locale_class(locales)]
+        update_priority = self.update_number * (update_number - 1)
+        return branch_priority + locale_priority + update_priority
+
+    def push(self, item, branch, locales, update_number):
+        """Queues an item for submission.
+
+        With the same aging rate for every item, comparing
+        `priority - aging * (now - enqueued)` between items does not depend on
+        `now`, so `priority + aging * enqueued` is a stable heap key.
+        """
+        priority = self.priority(branch, locales, update_number)
+        key = priority + self.aging * self.clock()
+        log.debug("Queueing %s/%s/%s with priority %s", branch, locales,
+                  update_number, priority)
+        heapq.heappush(self._heap, (key, next(self._counter), item))
+
+    def pop(self):
+        """Returns the item to be submitted next"""
+        return heapq.heappop(self._heap)[-1]
+
+    def __len__(self):
+        return len(self._heap)
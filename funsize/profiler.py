@@ -0,0 +1,128 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+
+log = logging.getLogger(__name__)
+
+
+def collapse(frame):
+    """Returns a stack in the collapsed format used by flamegraph.pl,
+    outermost frame first: "file.py:function;file.py:function"
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("{}:{}".format(os.path.basename(code.co_filename),
+                                    code.co_name))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def tag_name(*parts):
+    """Filename safe tag from message type and branch
+
+    >>> tag_name("taskcluster", "mozilla-central")
+    'taskcluster-mozilla-central'
+    """
+    return "-".join(re.sub(r"[^\w.-]+", "_", str(p)) for p in parts if p)
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, directory, interval=0.01, duration=60, messages=None,
+                 thread_id=None, clock=time.time):
+        """Samples the stack of the consumer thread from a background thread.
+
+        Started on demand, e.g. from a SIGUSR2 handler, it stops after
+        `duration` seconds or `messages` processed messages, whichever comes
+        first. The samples are written to `directory` as collapsed stacks,
+        one file per tag: <pid>-<start time>-<message type>-<branch>.collapsed
+
+        :param interval: seconds between samples
+        :param duration: profiling window in seconds, None for no limit
+        :param messages: number of messages to profile, None for no limit
+        :param thread_id: thread to sample, defaults to the creating thread
+        """
+        self.directory = directory
+        self.interval = interval
+        self.duration = duration
+        self.messages = messages
+        self.thread_id = thread_id or threading.current_thread().ident
+        self.clock = clock
+        self.tag = "idle"
+        self.running = False
+        self.started_at = None
+        self.profiled_messages = 0
+        self.stacks = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts a profiling window, safe to call from a signal handler"""
+        if self.running:
+            log.info("Profiler already running")
+            return
+        log.info("Profiling for %ss or %s messages, writing to %s",
+                 self.duration, self.messages, self.directory)
+        self.running = True
+        self.started_at = self.clock()
+        self.profiled_messages = 0
+        self.stacks.clear()
+        thread = threading.Thread(target=self._run, name="funsize-profiler")
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack = collapse(frame)
+        with self._lock:
+            if not self.running:
+                return
+            self.stacks[self.tag][stack] += 1
+        if self.duration is not None and \
+                self.clock() - self.started_at >= self.duration:
+            self.stop()
+
+    def set_tag(self, message_type, branch=None):
+        """Attributes the following samples to a message type and branch"""
+        self.tag = tag_name(message_type, branch)
+
+    def message_done(self):
+        """Counts a processed message, stopping after `messages` of them"""
+        self.tag = "idle"
+        if not self.running:
+            return
+        self.profiled_messages += 1
+        if self.messages is not None and \
+                self.profiled_messages >= self.messages:
+            self.stop()
+
+    def stop(self):
+        """Stops sampling and writes the collected stacks"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            stacks, self.stacks = self.stacks, defaultdict(
+                lambda: defaultdict(int))
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        prefix = "{}-{}".format(os.getpid(), time.strftime(
+            "%Y%m%d%H%M%S", time.gmtime(self.started_at)))
+        for tag, counts in stacks.items():
+            path = os.path.join(self.directory,
+                                "{}-{}.collapsed".format(prefix, tag))
+            with open(path, "w") as f:
+                for stack, count in sorted(counts.items()):
+                    f.write("{} {}\n".format(stack, count))
+            log.info("Wrote %s samples to %s", sum(counts.values()), path)
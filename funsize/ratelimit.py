@@ -0,0 +1,259 @@
+import email.utils
+import logging
+import re
+import threading
+import time
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+
+from funsize.utils import taskcluster_service_url
+
+log = logging.getLogger(__name__)
+
+# Endpoint classes with their own bucket, the first matching entry wins.
+# "url" is searched in the full request URL, {tc_queue} stands for the
+# Taskcluster queue base URL. Other requests get a bucket per host with the
+# default parameters.
+DEFAULT_ENDPOINTS = [
+    {"name": "balrog-releases", "url": r"/releases(\?|$)",
+     "rate": 2, "burst": 5, "max_rate": 10},
+    {"name": "balrog-builds", "url": r"/releases/[^/]+/builds/",
+     "rate": 10, "burst": 20, "max_rate": 50},
+    {"name": "treeherder-resultset", "url": r"/project/[^/]+/resultset/",
+     "rate": 2, "burst": 5, "max_rate": 10},
+    {"name": "taskcluster-create-task", "method": "PUT",
+     "url": r"{tc_queue}/task/[^/?]+$",
+     "rate": 20, "burst": 50, "max_rate": 100},
+    {"name": "taskcluster-claim-task",
+     "url": r"{tc_queue}/task/[^/]+/runs/\d+/(claim|completed)",
+     "rate": 10, "burst": 20, "max_rate": 50},
+]
+DEFAULT_BUCKET = {"rate": 20, "burst": 20, "max_rate": 100}
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header, None if unparsable
+
+    >>> parse_retry_after("120")
+    120.0
+    >>> parse_retry_after("Wed, 19 Oct 2016 12:00:30 GMT", now=1476878400)
+    30.0
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(float(email.utils.mktime_tz(parsed) - now), 0.0)
+
+
+def is_throttled(status):
+    return status == 429 or status >= 500
+
+
+class TokenBucket(object):
+
+    def __init__(self, name, rate=20, burst=20, min_rate=0.1, max_rate=100,
+                 increase=0.05, decrease=0.5, clock=time.time,
+                 sleep=time.sleep):
+        """Token bucket with an AIMD adapted rate.
+
+        Every successful response adds `increase` requests per second to the
+        rate, up to max_rate. A 429, a 5xx or a connection error multiplies
+        it by `decrease`, at most once per second so a burst of failures
+        counts once, down to min_rate. A Retry-After header also holds all
+        requests of the bucket for the given time.
+
+        :param rate: initial requests per second
+        :param burst: requests allowed at once after an idle period
+        """
+        self.name = name
+        self.rate = float(rate)
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.blocked_until = 0
+        self.last_decrease = None
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate,
+                          self.burst)
+        self.updated = now
+
+    def acquire(self):
+        """Blocks until a request may be sent
+
+        :return: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.requests += 1
+                        self.waited += waited
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.rate + self.increase, self.max_rate)
+
+    def throttle(self, retry_after=None):
+        """Backs off after a 429, a 5xx or a connection error
+
+        :param retry_after: seconds to hold the requests of the bucket
+        """
+        with self._lock:
+            now = self.clock()
+            self.throttled += 1
+            if self.last_decrease is None or now - self.last_decrease >= 1:
+                self._refill(now)
+                self.rate = max(self.rate * self.decrease, self.min_rate)
+                self.last_decrease = now
+            if retry_after:
+                self.blocked_until = max(self.blocked_until,
+                                         now + retry_after)
+                self.tokens = min(self.tokens, 0)
+        log.warning("Throttled by %s, %.1f requests per second%s", self.name,
+                    self.rate, " for {:.0f}s".format(retry_after)
+                    if retry_after else "")
+
+
+class RateLimiter(object):
+
+    def __init__(self, endpoints=None, default=None, tc_queue_url=None,
+                 clock=time.time, sleep=time.sleep):
+        """Client side rate limits of the upstream services, shared by all
+        the HTTP clients of a process through the transport.
+
+        :param endpoints: endpoint classes, see DEFAULT_ENDPOINTS. Each
+            entry has a "name", a "url" regex, an optional "method" and the
+            TokenBucket parameters.
+        :param default: TokenBucket parameters of the per host buckets of
+            the other requests
+        :param tc_queue_url: Taskcluster queue base URL, see
+            funsize.utils.taskcluster_service_url
+        """
+        if tc_queue_url is None:
+            tc_queue_url = taskcluster_service_url({}, "queue")
+        self.endpoints = []
+        for endpoint in DEFAULT_ENDPOINTS if endpoints is None else endpoints:
+            endpoint = dict(endpoint)
+            name = endpoint.pop("name")
+            pattern = re.compile(endpoint.pop("url").replace(
+                "{tc_queue}", re.escape(tc_queue_url.rstrip("/"))))
+            method = endpoint.pop("method", None)
+            self.endpoints.append((name, method, pattern, endpoint))
+        self.default = dict(DEFAULT_BUCKET, **(default or {}))
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def classify(self, method, url):
+        """Returns the endpoint class name and bucket parameters of a request
+
+        >>> RateLimiter().classify(
+        ...     "GET", "https://aus4-admin.mozilla.org/api/releases?a=b")[0]
+        'balrog-releases'
+        >>> RateLimiter().classify("GET", "https://archive.mozilla.org/a")[0]
+        'archive.mozilla.org'
+        """
+        for name, endpoint_method, pattern, params in self.endpoints:
+            if endpoint_method and endpoint_method != method:
+                continue
+            if pattern.search(url):
+                return name, params
+        return urlsplit(url).hostname, self.default
+
+    def bucket(self, method, url):
+        name, params = self.classify(method, url)
+        with self._lock:
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                bucket = TokenBucket(name, clock=self.clock, sleep=self.sleep,
+                                     **params)
+                self.buckets[name] = bucket
+        return bucket
+
+    def wrap(self, send, retry=None):
+        """Rate limits a requests adapter send method and retries its
+        throttled responses.
+
+        The adapter must not retry statuses itself, so every attempt takes a
+        token and adapts the rate.
+
+        :param retry: urllib3 Retry deciding which statuses and methods are
+            retried, how many times and with which backoff_factor. None
+            does not retry.
+        """
+        def limited_send(request, **kwargs):
+            bucket = self.bucket(request.method, request.url)
+            attempt = 0
+            while True:
+                bucket.acquire()
+                try:
+                    response = send(request, **kwargs)
+                except Exception:
+                    bucket.throttle()
+                    raise
+                if not is_throttled(response.status_code):
+                    bucket.success()
+                    return response
+                retry_after = parse_retry_after(
+                    response.headers.get("Retry-After"))
+                # Retry-After also holds the next acquire()
+                bucket.throttle(retry_after)
+                attempt += 1
+                if retry is None or attempt > retry.total or \
+                        not retry.is_retry(request.method,
+                                           response.status_code,
+                                           retry_after is not None):
+                    return response
+                response.close()
+                self.sleep(backoff_time(retry.backoff_factor, attempt))
+        return limited_send
+
+    def log_stats(self):
+        with self._lock:
+            buckets = sorted(self.buckets.items())
+        for name, b in buckets:
+            log.info("%s: %s requests, %s throttled, %.0fs waited, %.1f "
+                     "requests per second", name, b.requests, b.throttled,
+                     b.waited, b.rate)
+
+
+def backoff_time(backoff_factor, attempt):
+    """Seconds to sleep before a retry, as urllib3 does
+
+    >>> [backoff_time(2, attempt) for attempt in range(1, 6)]
+    [0, 4, 8, 16, 32]
+    """
+    if attempt <= 1:
+        return 0
+    return min(backoff_factor * 2 ** (attempt - 1), 120)
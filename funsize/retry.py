@@ -0,0 +1,140 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+ATTEMPTS_HEADER = "x-funsize-attempts"
+ERROR_HEADER = "x-funsize-error"
+ROUTING_KEY_HEADER = "x-funsize-routing-key"
+SUBMITTED_HEADER = "x-funsize-submitted"
+
+
+def original_routing_key(message):
+    """Routing key a message was first published with, retried messages
+    come back through the retry exchange with the queue name instead.
+    """
+    headers = message.headers or {}
+    return headers.get(ROUTING_KEY_HEADER,
+                       message.delivery_info["routing_key"])
+
+
+def submitted_partials(message):
+    """Keys of the partials already submitted by previous attempts, see
+    funsize.dedup.partial_key
+    """
+    headers = message.headers or {}
+    return set(headers.get(SUBMITTED_HEADER, ()))
+
+
+class RetryQueues(object):
+
+    def __init__(self, exchange_name, attempts=5, delay=60, factor=4,
+                 max_delay=3600):
+        """Delayed retries and dead lettering of failed pulse messages.
+
+        Every consumed queue gets a retry queue per delay, messages wait
+        there for the delay (x-message-ttl) and are dead lettered back to
+        the consumed queue through the retry exchange. After `attempts`
+        retries they go to <queue>-dead with the failure reason in the
+        x-funsize-error header.
+
+        :param exchange_name: exchange owned by the pulse user, e.g.
+            exchange/<user>/funsize-retry
+        :param delay: seconds before the first retry
+        :param factor: delay multiplier of every following retry
+        :param max_delay: upper bound of the delay
+        """
+        self.exchange_name = exchange_name
+        self.attempts = attempts
+        self.delay = delay
+        self.factor = factor
+        self.max_delay = max_delay
+
+    def retry_delay(self, attempt):
+        """Seconds to wait before a retry, attempt starts at 1
+
+        >>> RetryQueues("e", delay=60, factor=4, max_delay=3600).retry_delay(3)
+        960
+        """
+        return min(self.delay * self.factor ** (attempt - 1), self.max_delay)
+
+    @property
+    def delays(self):
+        return sorted(set(self.retry_delay(a)
+                          for a in range(1, self.attempts + 1)))
+
+    @staticmethod
+    def retry_queue_name(queue_name, delay):
+        return "{}-retry-{}".format(queue_name, delay)
+
+    @staticmethod
+    def dead_queue_name(queue_name):
+        return "{}-dead".format(queue_name)
+
+    @property
+    def exchange(self):
+        from kombu import Exchange
+        return Exchange(self.exchange_name, type="direct", durable=True)
+
+    def binding(self, queue_name):
+        """(exchange name, routing key) binding of a consumed queue to the
+        retry exchange, through which expired retries come back
+        """
+        return self.exchange_name, queue_name
+
+    def declare(self, channel, queue_names):
+        """Declares the retry exchange and the retry and dead letter queues
+        of the consumed queues, and binds the consumed queues to the retry
+        exchange.
+        """
+        from kombu import Queue
+        exchange = self.exchange(channel)
+        exchange.declare()
+        for queue_name in queue_names:
+            for delay in self.delays:
+                name = self.retry_queue_name(queue_name, delay)
+                Queue(name=name, exchange=exchange, routing_key=name,
+                      durable=True, auto_delete=False, channel=channel,
+                      queue_arguments={
+                          "x-message-ttl": delay * 1000,
+                          "x-dead-letter-exchange": self.exchange_name,
+                          "x-dead-letter-routing-key": queue_name,
+                      }).declare()
+            name = self.dead_queue_name(queue_name)
+            Queue(name=name, exchange=exchange, routing_key=name,
+                  durable=True, auto_delete=False, channel=channel).declare()
+            Queue(name=queue_name, exchange=exchange, routing_key=queue_name,
+                  durable=True, auto_delete=False, channel=channel).declare()
+
+    def republish(self, producer, message, queue_name, error,
+                  submitted=()):
+        """Publishes a failed message to its next retry queue, or to the
+        dead letter queue after the last attempt.
+
+        :type producer: kombu.Producer
+        :param submitted: keys of the partials submitted by this attempt,
+            added to the x-funsize-submitted header so the next attempts
+            only submit the partials that failed
+        :return: name of the queue the message was published to
+        """
+        headers = dict(message.headers or {})
+        headers[SUBMITTED_HEADER] = sorted(
+            submitted_partials(message) | set(submitted))
+        attempt = headers.get(ATTEMPTS_HEADER, 0) + 1
+        headers[ATTEMPTS_HEADER] = attempt
+        headers[ERROR_HEADER] = error[:1000]
+        headers[ROUTING_KEY_HEADER] = original_routing_key(message)
+        if attempt > self.attempts:
+            target = self.dead_queue_name(queue_name)
+            log.error("Giving up on message after %s attempts: %s",
+                      attempt - 1, error)
+        else:
+            delay = self.retry_delay(attempt)
+            target = self.retry_queue_name(queue_name, delay)
+            log.warning("Retrying message in %ss (attempt %s): %s", delay,
+                        attempt, error)
+        producer.publish(message.body, exchange=self.exchange_name,
+                         routing_key=target, headers=headers,
+                         content_type=message.content_type,
+                         content_encoding=message.content_encoding,
+                         delivery_mode=2)
+        return target
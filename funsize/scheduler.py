@@ -1,34 +1,38 @@
 import argparse
 import logging
+import signal
 import site
-import taskcluster
+import time
 import yaml
 import os
-from kombu import Connection
+# kombu, taskcluster and funsize.worker are imported by run_worker, so the
+# supervisor process does not load them
 
 site.addsitedir(os.path.join(os.path.dirname(__file__), '..'))
-from funsize import BalrogClient, FunsizeWorker
+from funsize import codec
+from funsize.balrog import BalrogClient
+from funsize.backpressure import BackpressureController, \
+    template_worker_types
+from funsize.bindings import BindingsAPI
+from funsize.dedup import PartialsIndex
+from funsize.latency import LatencyTracker
+from funsize.logs import start_async_logging, stop_async_logging
+from funsize.packing import CostModel
+from funsize.prefetch import BalrogPrefetcher, BalrogStore
+from funsize.profiler import SamplingProfiler
+from funsize.retry import RetryQueues
+from funsize.shards import shards_from_config
+from funsize.supervisor import Supervisor
+from funsize.transport import Transport, set_transport
+from funsize.utils import taskcluster_service_url
 
 log = logging.getLogger(__name__)
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-c", "--config", required=True,
-                        type=argparse.FileType(),
-                        help="YAML configuration file")
-    parser.add_argument("-v", "--verbose", dest="log_level",
-                        action="store_const", const=logging.DEBUG,
-                        default=logging.INFO)
-    args = parser.parse_args()
-    logging.basicConfig(
-        level=args.log_level,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    logging.getLogger("requests").setLevel(logging.WARN)
-    logging.getLogger("taskcluster").setLevel(logging.WARN)
-    logging.getLogger("hawk").setLevel(logging.WARN)
-    config = yaml.safe_load(args.config)
-
+def get_settings(config):
+    """Merges the YAML configuration and environment overrides into the
+    settings needed to start a worker.
+    """
     api_root = os.environ.get("BALROG_API_ROOT", config["balrog"]["api_root"])
     balrog_worker_api_root = os.environ.get(
         "BALROG_WORKER_API_ROOT", config["balrog"]["worker_api_root"])
@@ -50,8 +54,6 @@ def main():
             "AWS_SECRET_ACCESS_KEY", config["s3"]["aws_secret_access_key"])
     }
 
-    os.environ.get("PULSE_QUEUE_NAME", config["pulse"]["queue"])
-
     if "TASKCLUSTER_CLIENT_ID" in os.environ and \
             "TASKCLUSTER_ACCESS_TOKEN" in os.environ:
         tc_opts = {
@@ -65,23 +67,222 @@ def main():
 
     th_api_root = os.environ.get("TH_API_ROOT", config["th_api_root"])
 
-    cert = config["balrog"].get("cert")
-    balrog_client = BalrogClient(api_root=api_root, auth=auth, cert=cert)
-    tc_queue = taskcluster.Queue(tc_opts)
+    consume_shards = config["pulse"].get("consume_shards")
+    if "PULSE_CONSUME_SHARDS" in os.environ:
+        consume_shards = os.environ["PULSE_CONSUME_SHARDS"].split(",")
+
     with open(config["signing"]["pvt_key"]) as f:
         pvt_key = f.read()
 
+    return {
+        "config": config,
+        "api_root": api_root,
+        "balrog_worker_api_root": balrog_worker_api_root,
+        "auth": auth,
+        "cert": config["balrog"].get("cert"),
+        "pulse_user": pulse_user,
+        "pulse_password": pulse_password,
+        "queue_name": queue_name,
+        "s3_info": s3_info,
+        "tc_opts": tc_opts,
+        "th_api_root": th_api_root,
+        "pvt_key": pvt_key,
+        "shards": shards_from_config(config["pulse"].get("shards")),
+        "consume_shards": consume_shards,
+        "priorities": config.get("priorities"),
+        "compact_bindings": config["pulse"].get("compact_bindings", False),
+        "management_api": config["pulse"].get("management_api"),
+        "batch_size": config["pulse"].get("batch_size", 1),
+        "batch_delay": config["pulse"].get("batch_delay", 5),
+        "dedup": config.get("dedup", {}),
+        "limits": config.get("partials"),
+        "cost_model": config.get("cost_model", {}),
+        "backpressure": config.get("backpressure", {}),
+        "http": config.get("http", {}),
+        "profiling": config.get("profiling", {}),
+        "prefetch": config.get("prefetch", {}),
+        "retry": config.get("retry", {}),
+        "latency": config.get("latency", {}),
+        "logging": config.get("logging", {}),
+        "json": config.get("json", {}),
+    }
+
+
+def run_worker(settings):
+    """Runs a single consumer until it is asked to stop.
+
+    Every call creates its own pulse connection, Balrog and Taskcluster
+    clients, so it is safe to call it in forked child processes.
+    """
+    # Reported as the time until the worker starts consuming
+    started_at = time.time()
+    listener = None
+    if settings["logging"].get("async", False):
+        listener = start_async_logging(
+            burst=settings["logging"].get("burst", 20),
+            interval=settings["logging"].get("interval", 60))
+    codec.use(settings["json"].get("backend"))
+    codec.register_kombu()
+    log.info("Parsing JSON with %s", codec.backend)
+    import taskcluster
+    from kombu import Connection
+    from funsize.worker import FunsizeWorker, PRODUCTION_BRANCHES, \
+        STAGING_BRANCHES, PLATFORMS
+    config = settings["config"]
+    http = dict(settings["http"])
+    if http.get("rate_limits"):
+        http["rate_limits"] = dict(
+            http["rate_limits"],
+            tc_queue_url=taskcluster_service_url(settings["tc_opts"],
+                                                 "queue"))
+    # The Taskcluster APIs are safe to retry, POST requests included
+    transport = Transport(
+        idempotent_prefixes=[
+            taskcluster_service_url(settings["tc_opts"], service) + "/"
+            for service in ("queue", "index")],
+        **http)
+    set_transport(transport)
+    balrog_client = BalrogClient(api_root=settings["api_root"],
+                                 auth=settings["auth"], cert=settings["cert"],
+                                 recent_months=config["balrog"].get(
+                                     "recent_months", 3),
+                                 transport=transport)
+    # The transport retries the failed Taskcluster requests, POST included,
+    # do not retry them again in the Taskcluster client
+    tc_opts = dict(settings["tc_opts"], maxRetries=0)
+    tc_queue = taskcluster.Queue(tc_opts, session=transport.session)
+    partials_index = None
+    if settings["dedup"].get("enabled"):
+        partials_index = PartialsIndex(
+            tc_index=taskcluster.Index(tc_opts, session=transport.session),
+            in_flight_ttl=settings["dedup"].get("in_flight_ttl", 4 * 3600),
+            shared=settings["dedup"].get("shared", True))
+    backpressure = None
+    if settings["backpressure"].get("enabled"):
+        backpressure = BackpressureController(
+            tc_queue=tc_queue, worker_types=template_worker_types(),
+            high_watermark=settings["backpressure"]["high_watermark"],
+            low_watermark=settings["backpressure"]["low_watermark"],
+            interval=settings["backpressure"].get("interval", 60),
+            max_failed_samples=settings["backpressure"].get(
+                "max_failed_samples", 5))
+    balrog_store = prefetcher = None
+    if settings["prefetch"].get("enabled"):
+        prefetch = settings["prefetch"]
+        balrog_store = BalrogStore(
+            ttl=prefetch.get("ttl", 1800),
+            negative_ttl=prefetch.get("negative_ttl", 60))
+        prefetcher = BalrogPrefetcher(
+            balrog_client, balrog_store,
+            products=prefetch.get("products", ["Firefox"]),
+            branches=PRODUCTION_BRANCHES + STAGING_BRANCHES,
+            platforms=PLATFORMS, locales=prefetch.get("locales", ["en-US"]),
+            release_limit=prefetch.get("release_limit", 20),
+            interval=prefetch.get("interval", 600))
+        prefetcher.start()
+    retry_queues = None
+    retry = dict(settings["retry"])
+    if retry.pop("enabled", False):
+        retry_queues = RetryQueues(
+            exchange_name="exchange/{}/{}-retry".format(
+                settings["pulse_user"], config["pulse"]["queue"]),
+            **retry)
+    cost_model = CostModel(**settings["cost_model"])
+    latency = None
+    if settings["latency"].get("enabled"):
+        latency = LatencyTracker(
+            queue_prefix="queue/{}/{}-latency".format(
+                settings["pulse_user"], config["pulse"]["queue"]),
+            exchanges=settings["latency"]["exchanges"],
+            report_interval=settings["latency"].get("report_interval", 600),
+            cost_model=cost_model)
+    profiler = None
+    profiling = dict(settings["profiling"])
+    start_profiling = profiling.pop("enabled", False)
+    if profiling.get("directory"):
+        profiler = SamplingProfiler(**profiling)
+    bindings_api = None
+    if settings["management_api"]:
+        bindings_api = BindingsAPI(
+            settings["management_api"],
+            auth=(settings["pulse_user"], settings["pulse_password"]))
+
     with Connection(hostname='pulse.mozilla.org', port=5671,
-                    userid=pulse_user, password=pulse_password,
+                    userid=settings["pulse_user"],
+                    password=settings["pulse_password"],
                     virtual_host='/', ssl=True) as connection:
-        FunsizeWorker(connection=connection, queue_name=queue_name,
-                      bb_exchange=config["pulse"]["bb_exchange"],
-                      tc_exchange=config["pulse"]["tc_exchange"],
-                      balrog_client=balrog_client,
-                      tc_queue=tc_queue, s3_info=s3_info,
-                      th_api_root=th_api_root,
-                      balrog_worker_api_root=balrog_worker_api_root,
-                      pvt_key=pvt_key).run()
+        worker = FunsizeWorker(
+            connection=connection, queue_name=settings["queue_name"],
+            bb_exchange=config["pulse"]["bb_exchange"],
+            tc_exchange=config["pulse"]["tc_exchange"],
+            balrog_client=balrog_client,
+            tc_queue=tc_queue, s3_info=settings["s3_info"],
+            th_api_root=settings["th_api_root"],
+            balrog_worker_api_root=settings["balrog_worker_api_root"],
+            pvt_key=settings["pvt_key"], shards=settings["shards"],
+            consume_shards=settings["consume_shards"],
+            priorities=settings["priorities"],
+            compact_bindings=settings["compact_bindings"],
+            bindings_api=bindings_api, started_at=started_at,
+            partials_index=partials_index, limits=settings["limits"],
+            cost_model=cost_model,
+            backpressure=backpressure, batch_size=settings["batch_size"],
+            batch_delay=settings["batch_delay"], profiler=profiler,
+            balrog_store=balrog_store, retry_queues=retry_queues,
+            latency=latency)
+
+        def stop(signum, frame):
+            # Let the consumer finish the message in hand and exit the loop
+            log.info("Got signal %s, draining", signum)
+            worker.should_stop = True
+
+        signal.signal(signal.SIGTERM, stop)
+        if profiler:
+            signal.signal(signal.SIGUSR2, lambda signum, frame:
+                          profiler.start())
+            if start_profiling:
+                profiler.start()
+        try:
+            worker.run()
+        except Exception:
+            log.exception("Worker crashed")
+            raise
+        finally:
+            if latency:
+                latency.report()
+            if prefetcher:
+                prefetcher.stop()
+            transport.log_stats()
+            # Last, so the records above and the crash are written out
+            stop_async_logging(listener)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", required=True,
+                        type=argparse.FileType(),
+                        help="YAML configuration file")
+    parser.add_argument("-v", "--verbose", dest="log_level",
+                        action="store_const", const=logging.DEBUG,
+                        default=logging.INFO)
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help="Number of consumer processes to pre-fork")
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=args.log_level,
+        format="%(asctime)s - %(name)s - %(process)d - %(levelname)s - "
+               "%(message)s")
+    logging.getLogger("requests").setLevel(logging.WARN)
+    logging.getLogger("taskcluster").setLevel(logging.WARN)
+    logging.getLogger("hawk").setLevel(logging.WARN)
+    config = yaml.safe_load(args.config)
+    settings = get_settings(config)
+
+    if args.processes > 1:
+        Supervisor(target=run_worker, args=(settings,),
+                   processes=args.processes).run()
+    else:
+        run_worker(settings)
 
 
 if __name__ == '__main__':
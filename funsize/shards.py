@@ -0,0 +1,79 @@
+import logging
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class Shard(object):
+
+    def __init__(self, name, branches=None, platforms=None):
+        """A partition of the pulse bindings, consumed from its own queue.
+
+        :param name: shard name, appended to the queue name
+        :param branches: branches routed to this shard, None matches all
+        :param platforms: platforms routed to this shard, None matches all
+        """
+        self.name = name
+        self.branches = branches
+        self.platforms = platforms
+
+    def matches(self, branch, platform=None):
+        """Checks if a branch/platform pair belongs to this shard.
+
+        Taskcluster routes do not contain the platform, so `platform=None`
+        matches using the branch only.
+        """
+        if self.branches and branch not in self.branches:
+            return False
+        if platform and self.platforms and platform not in self.platforms:
+            return False
+        return True
+
+    def queue_name(self, base_name):
+        if self.name is None:
+            return base_name
+        return "{}-{}".format(base_name, self.name)
+
+    def __repr__(self):
+        return "Shard({!r}, branches={!r}, platforms={!r})".format(
+            self.name, self.branches, self.platforms)
+
+
+def shards_from_config(shards_config):
+    """Builds the list of shards from the `pulse.shards` config section.
+
+    Without any shards configured, a single unnamed shard consuming from the
+    main queue is returned.
+    """
+    if not shards_config:
+        return [Shard(None)]
+    return [Shard(s["name"], branches=s.get("branches"),
+                  platforms=s.get("platforms"))
+            for s in shards_config]
+
+
+def assign_bindings(shards, bb_bindings, tc_bindings):
+    """Splits bindings between shards.
+
+    Every binding is assigned to the first matching shard only, so the same
+    pulse message is never delivered to several shard queues.
+
+    :param shards: ordered list of Shard
+    :param bb_bindings: list of (branch, platform, routing_key)
+    :param tc_bindings: list of (branch, routing_key)
+    :return: OrderedDict of {shard name: {"bb": [keys], "tc": [keys]}}
+    """
+    assignment = OrderedDict((s.name, {"bb": [], "tc": []}) for s in shards)
+    for branch, platform, routing_key in bb_bindings:
+        shard = next((s for s in shards if s.matches(branch, platform)), None)
+        if shard is None:
+            log.warning("No shard for %s, dropping binding", routing_key)
+            continue
+        assignment[shard.name]["bb"].append(routing_key)
+    for branch, routing_key in tc_bindings:
+        shard = next((s for s in shards if s.matches(branch)), None)
+        if shard is None:
+            log.warning("No shard for %s, dropping binding", routing_key)
+            continue
+        assignment[shard.name]["tc"].append(routing_key)
+    return assignment
@@ -0,0 +1,121 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Supervisor(object):
+
+    def __init__(self, target, processes, args=(), poll_interval=1,
+                 min_uptime=10, max_restart_delay=60, shutdown_timeout=120):
+        """Pre-forks and supervises a fixed number of worker processes.
+
+        Each child runs ``target(*args)``. Children that exit are restarted,
+        with an increasing delay if they keep dying shortly after start.
+        SIGTERM and SIGINT are forwarded to the children as SIGTERM, so they
+        can finish the message in hand before exiting. SIGUSR2 is forwarded
+        as is, it starts the profiler of every child.
+
+        :param target: callable run in every child process
+        :param processes: number of child processes to keep alive
+        :param args: positional arguments passed to target
+        :param poll_interval: seconds between child liveness checks
+        :param min_uptime: children exiting faster than this are considered
+            crash looping and restarted with a backoff
+        :param max_restart_delay: upper bound for the restart backoff
+        :param shutdown_timeout: seconds to wait for children to drain before
+            they are killed
+        """
+        self.target = target
+        self.processes = processes
+        self.args = args
+        self.poll_interval = poll_interval
+        self.min_uptime = min_uptime
+        self.max_restart_delay = max_restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        self.children = [None] * processes
+        self.started_at = [None] * processes
+        self.restart_delays = [0] * processes
+        self.restart_after = [0] * processes
+        self.stopping = False
+
+    def _child_main(self, slot):
+        # The supervisor coordinates shutdown; a terminal Ctrl-C reaches the
+        # whole process group, children wait for the forwarded SIGTERM.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # Handled by the target when profiling is configured
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+        log.info("Worker %s started with pid %s", slot, os.getpid())
+        self.target(*self.args)
+
+    def spawn(self, slot):
+        proc = multiprocessing.Process(target=self._child_main, args=(slot,),
+                                       name="funsize-worker-{}".format(slot))
+        proc.daemon = False
+        proc.start()
+        self.children[slot] = proc
+        self.started_at[slot] = time.time()
+        return proc
+
+    def handle_signal(self, signum, frame):
+        log.info("Got signal %s, shutting down workers", signum)
+        self.stopping = True
+
+    def forward_signal(self, signum, frame):
+        for proc in self.children:
+            if proc is not None and proc.is_alive():
+                log.info("Forwarding signal %s to worker pid %s", signum,
+                         proc.pid)
+                os.kill(proc.pid, signum)
+
+    def check_children(self):
+        """Restart children that are not running anymore"""
+        now = time.time()
+        for slot, proc in enumerate(self.children):
+            if proc is not None and proc.is_alive():
+                continue
+            if proc is not None:
+                proc.join()
+                uptime = now - self.started_at[slot]
+                log.warning("Worker %s (pid %s) exited with code %s after "
+                            "%.1fs", slot, proc.pid, proc.exitcode, uptime)
+                if uptime < self.min_uptime:
+                    self.restart_delays[slot] = min(
+                        max(self.restart_delays[slot] * 2, 1),
+                        self.max_restart_delay)
+                else:
+                    self.restart_delays[slot] = 0
+                self.restart_after[slot] = now + self.restart_delays[slot]
+                self.children[slot] = None
+            if now >= self.restart_after[slot]:
+                self.spawn(slot)
+
+    def shutdown(self):
+        alive = [p for p in self.children if p is not None and p.is_alive()]
+        for proc in alive:
+            log.info("Stopping worker pid %s", proc.pid)
+            proc.terminate()
+        deadline = time.time() + self.shutdown_timeout
+        for proc in alive:
+            proc.join(max(deadline - time.time(), 0))
+            if proc.is_alive():
+                log.error("Worker pid %s did not stop in time, killing it",
+                          proc.pid)
+                os.kill(proc.pid, signal.SIGKILL)
+                proc.join()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGUSR2, self.forward_signal)
+        log.info("Starting %s worker processes", self.processes)
+        try:
+            while not self.stopping:
+                self.check_children()
+                time.sleep(self.poll_interval)
+        finally:
+            self.shutdown()
@@ -0,0 +1,69 @@
+from unittest import TestCase
+import mock
+from funsize.backpressure import BackpressureController, \
+    template_worker_types
+
+
+class TestTemplateWorkerTypes(TestCase):
+
+    def test_worker_types(self):
+        worker_types = template_worker_types()
+        self.assertIn(("aws-provisioner-v1", "funsize-mar-generator"),
+                      worker_types)
+        self.assertNotIn("null-provisioner", [p for p, _ in worker_types])
+
+
+class TestBackpressureController(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.tc_queue = mock.Mock()
+        self.controller = BackpressureController(
+            self.tc_queue, [("p", "w")], high_watermark=100,
+            low_watermark=10, interval=60, clock=lambda: self.now)
+
+    def set_pending(self, count):
+        self.tc_queue.pendingTasks.return_value = {"pendingTasks": count}
+
+    def test_hysteresis(self):
+        self.set_pending(50)
+        self.assertFalse(self.controller.should_pause())
+        self.now += 60
+        self.set_pending(100)
+        self.assertTrue(self.controller.should_pause())
+        self.now += 60
+        self.set_pending(50)
+        self.assertTrue(self.controller.should_pause())
+        self.now += 60
+        self.set_pending(10)
+        self.assertFalse(self.controller.should_pause())
+
+    def test_interval(self):
+        self.set_pending(0)
+        self.controller.should_pause()
+        self.controller.should_pause()
+        self.assertEqual(self.tc_queue.pendingTasks.call_count, 1)
+        self.now += 60
+        self.controller.should_pause()
+        self.assertEqual(self.tc_queue.pendingTasks.call_count, 2)
+
+    def test_failed_samples(self):
+        from taskcluster.exceptions import TaskclusterFailure
+        self.controller.max_failed_samples = 2
+        self.set_pending(100)
+        self.assertTrue(self.controller.should_pause())
+        self.tc_queue.pendingTasks.side_effect = TaskclusterFailure("down")
+        self.now += 60
+        self.assertTrue(self.controller.should_pause())
+        self.assertEqual(self.controller.pending, {})
+        self.now += 60
+        self.assertFalse(self.controller.should_pause())
+
+    def test_same_worker_type(self):
+        self.controller.worker_types = [("p1", "w"), ("p2", "w")]
+        self.tc_queue.pendingTasks.side_effect = \
+            lambda provisioner, worker_type: \
+            {"pendingTasks": 100 if provisioner == "p1" else 0}
+        self.assertTrue(self.controller.should_pause())
+        self.assertEqual(self.controller.pending,
+                         {("p1", "w"): 100, ("p2", "w"): 0})
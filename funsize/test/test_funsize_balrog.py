@@ -0,0 +1,87 @@
+import io
+import json
+import os
+import time
+from unittest import TestCase
+import mock
+from funsize.balrog import UPDATE_PLATFORMS, BalrogClient, \
+    get_update_platform, iter_names
+
+
+class TestUpdatePlatforms(TestCase):
+
+    def test_precomputed_match_platform_map(self):
+        with open(os.path.join(os.path.dirname(__file__), "..", "data",
+                               "platform_map.json")) as f:
+            platform_map = json.load(f)
+        for platform, update_platform in UPDATE_PLATFORMS.items():
+            self.assertEqual(update_platform, platform_map[platform][0])
+
+    def test_fallback(self):
+        self.assertEqual(get_update_platform("android-x86"),
+                         "Android_x86-gcc3")
+
+
+class TestIterReleases(TestCase):
+
+    def setUp(self):
+        self.client = BalrogClient(
+            "api_root", recent_months=2,
+            clock=lambda: time.strptime("20161019", "%Y%m%d"))
+        self.names = ["Firefox-mozilla-central-nightly-{}".format(d) for d in
+                      ["20161018030202", "20161019030202", "20160910030202",
+                       "20160801030202", "20160701030202", "20160702030202",
+                       "20151231030202"]]
+
+    def fetch_names(self, product, name_prefix):
+        return iter([n for n in self.names if n.startswith(name_prefix)])
+
+    def test_newest_first(self):
+        with mock.patch.object(self.client, "_fetch_names",
+                               side_effect=self.fetch_names):
+            releases = self.client.get_releases("Firefox", "mozilla-central")
+        self.assertEqual(releases, sorted(self.names, reverse=True))
+
+    def test_limit_recent_months_only(self):
+        with mock.patch.object(self.client, "_fetch_names",
+                               side_effect=self.fetch_names) as fetch:
+            releases = self.client.get_releases("Firefox", "mozilla-central",
+                                                limit=3)
+        self.assertEqual(releases, sorted(self.names, reverse=True)[:3])
+        self.assertEqual(
+            [c[0][1] for c in fetch.call_args_list],
+            ["Firefox-mozilla-central-nightly-201610",
+             "Firefox-mozilla-central-nightly-201609"])
+
+    def test_limit_older(self):
+        with mock.patch.object(self.client, "_fetch_names",
+                               side_effect=self.fetch_names):
+            releases = self.client.get_releases("Firefox", "mozilla-central",
+                                                limit=5)
+        self.assertEqual(releases, sorted(self.names, reverse=True)[:5])
+
+    def test_older_by_year(self):
+        with mock.patch.object(self.client, "_fetch_names",
+                               side_effect=self.fetch_names) as fetch:
+            releases = self.client.get_releases("Firefox", "mozilla-central",
+                                                limit=7)
+        self.assertEqual(releases, sorted(self.names, reverse=True))
+        self.assertEqual(
+            [c[0][1] for c in fetch.call_args_list],
+            ["Firefox-mozilla-central-nightly-201610",
+             "Firefox-mozilla-central-nightly-201609",
+             "Firefox-mozilla-central-nightly-2016",
+             "Firefox-mozilla-central-nightly-2015"])
+
+    def test_lazy(self):
+        with mock.patch.object(self.client, "_fetch_names",
+                               side_effect=self.fetch_names) as fetch:
+            releases = self.client.iter_releases("Firefox", "mozilla-central")
+            next(releases)
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_iter_names(self):
+        response = mock.Mock()
+        response.content = b'{"names": ["a", "b"]}'
+        response.raw = io.BytesIO(b'{"names": ["a", "b"]}')
+        self.assertEqual(list(iter_names(response)), ["a", "b"])
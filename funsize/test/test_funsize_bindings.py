@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from unittest import TestCase
+import mock
+from funsize.bindings import BB_WILDCARD, plan_bindings, reconcile, \
+    topic_regex
+
+
+class TestTopicRegex(TestCase):
+
+    def test_star(self):
+        r = topic_regex(["build.m-c-linux-nightly.*.finished"])
+        self.assertTrue(r.match("build.m-c-linux-nightly.12.finished"))
+        self.assertFalse(r.match("build.m-c-linux-nightly-1.12.finished"))
+        self.assertFalse(r.match("build.m-c-linux-nightly.1.2.finished"))
+
+    def test_hash(self):
+        r = topic_regex(["route.#"])
+        self.assertTrue(r.match("route.a.b.c"))
+        self.assertFalse(r.match("other.a"))
+
+    def test_escape(self):
+        r = topic_regex(["build.a+b.*.finished"])
+        self.assertTrue(r.match("build.a+b.1.finished"))
+        self.assertFalse(r.match("build.aab.1.finished"))
+
+
+class TestPlanBindings(TestCase):
+
+    def test_compact(self):
+        shards = OrderedDict([("q", {"bb": ["b1", "b2"], "tc": ["t1"]})])
+        plan = plan_bindings(shards, "bb", "tc", compact=True)
+        self.assertEqual(plan["q"], [("bb", BB_WILDCARD), ("tc", "t1")])
+
+    def test_explicit(self):
+        shards = OrderedDict([("q", {"bb": ["b1", "b2"], "tc": ["t1"]})])
+        plan = plan_bindings(shards, "bb", "tc")
+        self.assertEqual(plan["q"], [("bb", "b1"), ("bb", "b2"),
+                                     ("tc", "t1")])
+
+    def test_compact_split_shards(self):
+        shards = OrderedDict([("q1", {"bb": ["b1"], "tc": []}),
+                              ("q2", {"bb": ["b2"], "tc": []})])
+        plan = plan_bindings(shards, "bb", "tc", compact=True)
+        self.assertEqual(plan["q1"], [("bb", "b1")])
+        self.assertEqual(plan["q2"], [("bb", "b2")])
+
+
+class TestReconcile(TestCase):
+
+    @mock.patch("kombu.Queue")
+    def test_delta(self, Queue):
+        queue = Queue.return_value
+        desired = set([("bb", "a"), ("bb", "b")])
+        existing = set([("bb", "b"), ("bb", "old")])
+        reconcile(None, "q", desired, existing)
+        queue.bind_to.assert_called_once_with(exchange="bb", routing_key="a")
+        queue.unbind_from.assert_called_once_with(exchange="bb",
+                                                  routing_key="old")
+
+    @mock.patch("kombu.Queue")
+    def test_retry_binding_kept(self, Queue):
+        from funsize.retry import RetryQueues
+        from funsize.worker import FunsizeWorker
+        queue = Queue.return_value
+        retry = RetryQueues("exchange/u/funsize-retry")
+        w = FunsizeWorker(connection=None, bb_exchange="bb_exchange",
+                          tc_exchange="tc_exchange",
+                          queue_name="queue/u/funsize", tc_queue=None,
+                          balrog_client=None, s3_info=None, th_api_root=None,
+                          balrog_worker_api_root=None, pvt_key=None,
+                          retry_queues=retry)
+        queue_name, bindings = next(iter(w.binding_plan.items()))
+        w.bindings_api = mock.Mock()
+        w.bindings_api.get.return_value = set(bindings) | set(
+            [retry.binding(queue_name)])
+        w.reconciled_queues(None)
+        self.assertFalse(queue.bind_to.called)
+        self.assertFalse(queue.unbind_from.called)
@@ -0,0 +1,49 @@
+from unittest import TestCase
+import mock
+from funsize import codec
+
+DOCUMENT = {
+    "names": ["Firefox-mozilla-central-nightly-20161019030208"],
+    "completes": [{"fileUrl": "https://archive.mozilla.org/a.mar",
+                   "hashValue": "f" * 128, "filesize": 52428800}],
+    "locale": u"é",
+    "score": 2.5,
+    "extra": None,
+}
+
+
+class TestCodec(TestCase):
+
+    def tearDown(self):
+        codec.use()
+
+    def test_backends_roundtrip(self):
+        for name in codec.available_backends():
+            codec.use(name)
+            self.assertEqual(codec.backend, name)
+            self.assertEqual(codec.loads(codec.dumps(DOCUMENT)), DOCUMENT)
+            self.assertEqual(
+                codec.loads(codec.dumps(DOCUMENT).encode("utf-8")), DOCUMENT)
+
+    def test_fastest_first(self):
+        codec.use()
+        self.assertEqual(codec.backend, codec.available_backends()[0])
+        self.assertEqual(codec.available_backends()[-1], "json")
+
+    def test_missing_backend(self):
+        self.assertRaises(ImportError, codec.use, "no_such_json")
+
+    def test_response_json(self):
+        response = mock.Mock(content=u'{"locale": "é"}'.encode("utf-8"))
+        self.assertEqual(codec.response_json(response), {"locale": u"é"})
+
+    def test_kombu(self):
+        from kombu.serialization import dumps, loads
+        codec.register_kombu()
+        content_type, encoding, data = dumps(DOCUMENT, serializer="json")
+        self.assertEqual(content_type, "application/json")
+        with mock.patch.object(codec, "_loads",
+                               side_effect=codec._loads) as fast_loads:
+            self.assertEqual(loads(data, content_type, encoding,
+                                   accept=["application/json"]), DOCUMENT)
+        self.assertEqual(fast_loads.call_count, 1)
@@ -0,0 +1,83 @@
+from unittest import TestCase
+import mock
+from funsize.dedup import PartialsIndex, in_flight_namespace, partial_key, \
+    partials_namespace
+
+
+def extra(locale, from_mar="https://from/mar"):
+    return {"locale": locale, "from_mar": from_mar, "to_mar": "https://to/mar"}
+
+
+class TestPartialsIndex(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.tc_index = mock.Mock()
+        self.tc_index.listTasks.return_value = {"tasks": []}
+        self.index = PartialsIndex(self.tc_index, in_flight_ttl=10,
+                                   shared=False, clock=lambda: self.now)
+
+    def test_key_stable(self):
+        self.assertEqual(partial_key("a", "b", "de"),
+                         partial_key("a", "b", "de"))
+        self.assertNotEqual(partial_key("a", "b", "de"),
+                            partial_key("a", "b", "fr"))
+
+    def test_skip_indexed(self):
+        ns = partials_namespace("m-c", "linux", "rev")
+        key = partial_key("https://from/mar", "https://to/mar", "de")
+        self.tc_index.listTasks.return_value = {
+            "tasks": [{"namespace": "{}.{}".format(ns, key)}]}
+        tasks = self.index.filter_new("m-c", "linux", "rev",
+                                      {1: [extra("de"), extra("fr")]})
+        self.assertEqual(tasks, {1: [extra("fr")]})
+        self.tc_index.listTasks.assert_called_once_with(ns, {})
+
+    def test_pagination(self):
+        self.tc_index.listTasks.side_effect = [
+            {"tasks": [], "continuationToken": "t"},
+            {"tasks": []},
+        ]
+        self.index.filter_new("m-c", "linux", "rev", {1: [extra("de")]})
+        self.assertEqual(self.tc_index.listTasks.call_args[0][1],
+                         {"continuationToken": "t"})
+
+    def test_skip_in_flight(self):
+        tasks = {1: [extra("de")]}
+        self.assertEqual(self.index.filter_new("b", "p", "r", tasks), tasks)
+        self.assertEqual(self.index.filter_new("b", "p", "r", tasks), {})
+        self.now = 11
+        self.assertEqual(self.index.filter_new("b", "p", "r", tasks), tasks)
+
+    def test_forget(self):
+        tasks = {1: [extra("de")]}
+        self.index.filter_new("b", "p", "r", tasks)
+        self.index.forget(tasks[1])
+        self.assertEqual(self.index.filter_new("b", "p", "r", tasks), tasks)
+
+    def test_skip_in_flight_elsewhere(self):
+        ns = in_flight_namespace("m-c", "linux", "rev")
+        key = partial_key("https://from/mar", "https://to/mar", "de")
+        expired = partial_key("https://from/mar", "https://to/mar", "fr")
+        self.tc_index.listTasks.side_effect = lambda namespace, payload: {
+            "tasks": [
+                {"namespace": "{}.{}".format(ns, key),
+                 "data": {"expires": 5}},
+                {"namespace": "{}.{}".format(ns, expired),
+                 "data": {"expires": -1}},
+            ] if namespace == ns else []}
+        self.index.shared = True
+        tasks = self.index.filter_new("m-c", "linux", "rev",
+                                      {1: [extra("de"), extra("fr")]})
+        self.assertEqual(tasks, {1: [extra("fr")]})
+
+    def test_mark_submitted(self):
+        self.index.shared = True
+        self.index.mark_submitted("m-c", "linux", "rev", [extra("de")],
+                                  "taskid")
+        namespace, payload = self.tc_index.insertTask.call_args[0]
+        key = partial_key("https://from/mar", "https://to/mar", "de")
+        self.assertEqual(namespace, "{}.{}".format(
+            in_flight_namespace("m-c", "linux", "rev"), key))
+        self.assertEqual(payload["taskId"], "taskid")
+        self.assertEqual(payload["data"], {"expires": 10})
@@ -0,0 +1,77 @@
+from unittest import TestCase
+import mock
+from funsize.latency import LatencyTracker, published_at
+
+
+def tasks():
+    return [{"taskId": worker_type, "task": {"workerType": worker_type}}
+            for worker_type in ["human-decision", "funsize-mar-generator",
+                                "signing-worker-v1", "funsize-balrog"]]
+
+
+def resolved(task_id, started, resolved, state="completed"):
+    return {"status": {"taskId": task_id, "runs": [
+        {"state": state,
+         "started": "2016-10-19T12:{:02d}:00.000Z".format(started),
+         "resolved": "2016-10-19T12:{:02d}:00.000Z".format(resolved)}]},
+        "runId": 0}
+
+
+class TestLatencyTracker(TestCase):
+
+    def setUp(self):
+        # 2016-10-19T12:00:00Z
+        self.start = 1476878400
+        self.now = self.start + 60
+        self.cost_model = mock.Mock()
+        self.cost_model.cached_size.return_value = 1024 * 1024
+        self.tracker = LatencyTracker("queue/u/funsize-latency", [],
+                                      cost_model=self.cost_model,
+                                      clock=lambda: self.now)
+        self.tracker.submitted("group", tasks(), "mozilla-central", "linux",
+                               1, [{"from_mar": "a", "to_mar": "b"}],
+                               published_at=self.start)
+
+    def samples(self, stage):
+        return list(self.tracker.samples[(stage, "mozilla-central",
+                                          "linux")])
+
+    def test_stages(self):
+        self.tracker.task_resolved(resolved("funsize-mar-generator", 3, 10))
+        self.tracker.task_resolved(resolved("signing-worker-v1", 10, 12))
+        self.tracker.task_resolved(resolved("funsize-balrog", 12, 13))
+        self.assertEqual(self.samples("funsize"), [60])
+        self.assertEqual(self.samples("queue"), [120])
+        self.assertEqual(self.samples("generator"), [420])
+        self.assertEqual(self.samples("signing"), [120])
+        self.assertEqual(self.samples("balrog"), [60])
+        self.assertEqual(self.samples("total"), [780])
+        self.assertEqual(self.tracker.groups, {})
+        self.assertEqual(self.tracker.tasks, {})
+        self.cost_model.record.assert_called_once_with(
+            "linux", 1, 2.0, 420, partials=1)
+
+    def test_unknown_size_not_recorded(self):
+        self.cost_model.cached_size.side_effect = \
+            lambda url: None if url == "b" else 1024 * 1024
+        self.tracker.task_resolved(resolved("funsize-mar-generator", 3, 10))
+        self.assertFalse(self.cost_model.record.called)
+        self.assertFalse(self.cost_model.mar_size.called)
+
+    def test_failed(self):
+        self.tracker.task_resolved(
+            resolved("funsize-mar-generator", 3, 10, state="failed"))
+        self.assertEqual(self.tracker.groups, {})
+        self.assertEqual(self.tracker.failures[
+            ("generator", "mozilla-central", "linux")], 1)
+
+    def test_unknown_task(self):
+        self.tracker.task_resolved(resolved("other", 3, 10))
+        self.assertEqual(len(self.tracker.groups), 1)
+
+    def test_published_at(self):
+        body = {"_meta": {"sent": "2016-10-19T12:00:00+0000"}}
+        self.assertEqual(published_at(body, None), self.start)
+        message = mock.Mock(payload=resolved("t", 0, 1))
+        self.assertEqual(published_at({}, message), self.start + 60)
+        self.assertIsNone(published_at({}, mock.Mock(payload={})))
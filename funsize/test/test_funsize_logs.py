@@ -0,0 +1,68 @@
+import logging
+from unittest import TestCase
+from funsize.logs import RateLimitFilter, start_async_logging, \
+    stop_async_logging
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+def make_record(msg, args=(), level=logging.INFO, **extra):
+    record = logging.LogRecord("funsize.worker", level, __file__, 1, msg,
+                               args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestRateLimitFilter(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.filter = RateLimitFilter(burst=2, interval=10,
+                                      clock=lambda: self.now)
+
+    def test_burst(self):
+        passed = [self.filter.filter(make_record("Build from: %s", ("u",)))
+                  for _ in range(4)]
+        self.assertEqual(passed, [True, True, False, False])
+        self.assertTrue(self.filter.filter(make_record("Other %s", ("u",))))
+        self.now = 10
+        record = make_record("Build from: %s", ("u",))
+        self.assertTrue(self.filter.filter(record))
+        self.assertEqual(record.getMessage(),
+                         "Build from: u (2 similar messages suppressed)")
+
+    def test_exempt(self):
+        for _ in range(3):
+            self.filter.filter(make_record("Build from: %s", ("u",)))
+        self.assertTrue(self.filter.filter(
+            make_record("Build from: %s", ("u",), level=logging.WARNING)))
+        self.assertTrue(self.filter.filter(
+            make_record("Build from: %s", ("u",), rate_limit=False)))
+
+
+class TestAsyncLogging(TestCase):
+
+    def test_async(self):
+        root = logging.getLogger()
+        handler = ListHandler()
+        saved = root.handlers[:], root.level
+        root.handlers = [handler]
+        root.setLevel(logging.INFO)
+        try:
+            listener = start_async_logging()
+            self.assertNotIn(handler, root.handlers)
+            logging.getLogger("funsize.test").info("hello %s", "world")
+            stop_async_logging(listener)
+            self.assertEqual(handler.messages, ["hello world"])
+            self.assertEqual(root.handlers, [handler])
+        finally:
+            root.handlers, level = saved
+            root.setLevel(level)
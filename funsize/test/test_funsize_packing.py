@@ -0,0 +1,93 @@
+from unittest import TestCase
+import mock
+from funsize.packing import CostModel, MB, get_limits, pack
+
+
+class TestGetLimits(TestCase):
+
+    def test_defaults(self):
+        limits = get_limits(None, "mozilla-central", "linux")
+        self.assertEqual(limits["partial_limit"], 4)
+        self.assertEqual(limits["per_chunk"], 5)
+
+    def test_precedence(self):
+        config = {
+            "default": {"per_chunk": 5, "target_runtime": 100},
+            "win64": {"per_chunk": 4},
+            "oak": {"per_chunk": 3},
+            "oak/win64": {"partial_limit": 2},
+        }
+        limits = get_limits(config, "oak", "win64")
+        self.assertEqual(limits, {"partial_limit": 2, "per_chunk": 3,
+                                  "target_runtime": 100,
+                                  "release_limit": 20,
+                                  "streaming": False})
+        limits = get_limits(config, "date", "win64")
+        self.assertEqual(limits["per_chunk"], 4)
+
+
+class TestPack(TestCase):
+
+    def test_per_chunk(self):
+        chunks = pack(list(range(7)), [1] * 7, target_runtime=100,
+                      per_chunk=3)
+        self.assertEqual([len(c) for c in chunks], [3, 3, 1])
+
+    def test_large_items_alone(self):
+        chunks = pack(["big", "a", "b"], [50, 5, 5], target_runtime=20,
+                      per_chunk=5)
+        self.assertEqual(chunks, [["big"], ["a", "b"]])
+
+    def test_all_items_kept(self):
+        items = list(range(20))
+        costs = [(i * 7) % 11 + 1 for i in items]
+        chunks = pack(items, costs, target_runtime=15, per_chunk=4)
+        self.assertEqual(sorted(i for c in chunks for i in c), items)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 4)
+            if len(chunk) > 1:
+                self.assertLessEqual(sum(costs[i] for i in chunk), 15)
+
+
+class TestCostModel(TestCase):
+
+    def test_estimate(self):
+        model = CostModel(overhead=10, seconds_per_mb=1,
+                          update_number_factor=0.5)
+        with mock.patch.object(model, "mar_size", return_value=50 * MB):
+            self.assertEqual(model.estimate("linux", 1, "a", "b"), 110)
+            self.assertEqual(model.estimate("linux", 3, "a", "b"), 210)
+
+    def test_record(self):
+        model = CostModel(overhead=0, seconds_per_mb=1, smoothing=0.5)
+        model.record("linux", 1, mbs=100, duration=300)
+        self.assertEqual(model.platform_seconds_per_mb["linux"], 2)
+
+    @mock.patch("funsize.transport.Transport.probe")
+    def test_mar_size_cached(self, head):
+        head.return_value.headers = {"Content-Length": "123"}
+        model = CostModel()
+        self.assertEqual(model.mar_size("https://mar"), 123)
+        self.assertEqual(model.mar_size("https://mar"), 123)
+        self.assertEqual(head.call_count, 1)
+
+    @mock.patch("funsize.transport.Transport.probe")
+    def test_mar_size_failure_cached(self, head):
+        head.return_value.headers = {}
+        now = [0]
+        model = CostModel(default_size=7, failure_ttl=10,
+                          clock=lambda: now[0])
+        self.assertEqual(model.mar_size("https://mar"), 7)
+        self.assertEqual(model.mar_size("https://mar"), 7)
+        self.assertEqual(head.call_count, 1)
+        now[0] = 10
+        head.return_value.headers = {"Content-Length": "123"}
+        self.assertEqual(model.mar_size("https://mar"), 123)
+        self.assertEqual(head.call_count, 2)
+
+    @mock.patch("funsize.transport.Transport.probe")
+    def test_known_size(self, head):
+        model = CostModel()
+        model.set_size("https://mar", 123)
+        self.assertEqual(model.mar_size("https://mar"), 123)
+        self.assertFalse(head.called)
@@ -0,0 +1,67 @@
+from unittest import TestCase
+import mock
+import requests
+from funsize.prefetch import BalrogPrefetcher, BalrogStore
+
+
+def not_found(*args):
+    response = mock.Mock(status_code=404)
+    raise requests.HTTPError("404", response=response)
+
+
+class TestBalrogStore(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.store = BalrogStore(ttl=10, negative_ttl=2,
+                                 clock=lambda: self.now)
+
+    def test_releases_ttl(self):
+        self.assertIsNone(self.store.releases("Firefox", "oak"))
+        self.store.set_releases("Firefox", "oak", ["r2", "r1"])
+        self.assertEqual(self.store.releases("Firefox", "oak"), ["r2", "r1"])
+        self.now = 10
+        self.assertIsNone(self.store.releases("Firefox", "oak"))
+
+    def test_missing_build(self):
+        self.store.set_build("r1", "linux", "de", None)
+        self.assertEqual(self.store.build("r1", "linux", "de"), (True, None))
+        self.assertEqual(self.store.build("r1", "linux", "fr"),
+                         (False, None))
+
+    def test_missing_build_ttl(self):
+        self.store.set_build("r1", "linux", "de", None)
+        self.store.set_build("r1", "linux", "fr", {})
+        self.now = 2
+        self.assertEqual(self.store.build("r1", "linux", "de"),
+                         (False, None))
+        self.assertEqual(self.store.build("r1", "linux", "fr"), (True, {}))
+        self.store.expire()
+        self.assertEqual(list(self.store._builds),
+                         [("r1", "linux", "fr")])
+
+    def test_expire(self):
+        self.store.set_build("r1", "linux", "de", {})
+        self.now = 10
+        self.store.expire()
+        self.assertEqual(self.store._builds, {})
+
+
+class TestBalrogPrefetcher(TestCase):
+
+    def test_refresh(self):
+        store = BalrogStore()
+        client = mock.Mock()
+        client.get_releases.return_value = ["r2", "r1"]
+        client.get_build.side_effect = lambda release, platform, locale: \
+            not_found() if release == "r1" else {"release": release}
+        prefetcher = BalrogPrefetcher(client, store, ["Firefox"], ["oak"],
+                                      ["linux"], ["en-US"], release_limit=2)
+        prefetcher.running = True
+        prefetcher.refresh()
+        self.assertEqual(store.releases("Firefox", "oak"), ["r2", "r1"])
+        self.assertEqual(store.build("r2", "linux", "en-US"),
+                         (True, {"release": "r2"}))
+        self.assertEqual(store.build("r1", "linux", "en-US"), (True, None))
+        prefetcher.refresh()
+        self.assertEqual(client.get_build.call_count, 2)
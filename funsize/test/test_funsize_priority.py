@@ -0,0 +1,52 @@
+from unittest import TestCase
+from funsize.priority import PriorityScheduler, locale_class
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPriorityScheduler(TestCase):
+
+    def test_locale_class(self):
+        self.assertEqual(locale_class(["en-US"]), "en-US")
+        self.assertEqual(locale_class(["de", "ka"]), "l10n")
+
+    def test_en_us_first(self):
+        s = PriorityScheduler(clock=FakeClock())
+        s.push("l10n", "mozilla-central", ["de"], 1)
+        s.push("en-US", "mozilla-central", ["en-US"], 1)
+        self.assertEqual(s.pop(), "en-US")
+        self.assertEqual(s.pop(), "l10n")
+
+    def test_update_number(self):
+        s = PriorityScheduler(clock=FakeClock())
+        s.push("old", "mozilla-central", ["de"], 4)
+        s.push("new", "mozilla-central", ["de"], 1)
+        self.assertEqual([s.pop(), s.pop()], ["new", "old"])
+
+    def test_branch(self):
+        s = PriorityScheduler(branches={"oak": 100}, clock=FakeClock())
+        s.push("oak", "oak", ["en-US"], 1)
+        s.push("date", "date", ["en-US"], 1)
+        self.assertEqual([s.pop(), s.pop()], ["date", "oak"])
+
+    def test_fifo_same_priority(self):
+        s = PriorityScheduler(clock=FakeClock())
+        for i in range(3):
+            s.push(i, "mozilla-central", ["de"], 1)
+        self.assertEqual([s.pop() for _ in range(3)], [0, 1, 2])
+
+    def test_aging(self):
+        clock = FakeClock()
+        s = PriorityScheduler(aging=1, clock=clock)
+        s.push("old l10n", "mozilla-central", ["de"], 1)
+        clock.now = 100
+        s.push("en-US", "mozilla-central", ["en-US"], 1)
+        self.assertEqual(s.pop(), "old l10n")
+        self.assertEqual(len(s), 1)
@@ -0,0 +1,54 @@
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+from funsize.profiler import SamplingProfiler, collapse
+
+
+class TestSamplingProfiler(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def make_profiler(self, **kwargs):
+        profiler = SamplingProfiler(self.directory, clock=lambda: self.now,
+                                    **kwargs)
+        # sample from the test thread without the background thread
+        profiler.running = True
+        profiler.started_at = self.now
+        return profiler
+
+    def test_collapse(self):
+        stack = collapse(sys._getframe())
+        self.assertTrue(stack.endswith(
+            "test_funsize_profiler.py:test_collapse"))
+
+    def test_messages(self):
+        profiler = self.make_profiler(duration=None, messages=2)
+        profiler.set_tag("buildbot", "mozilla-central")
+        profiler.sample()
+        profiler.message_done()
+        profiler.set_tag("taskcluster", "oak")
+        profiler.sample()
+        profiler.sample()
+        profiler.message_done()
+        self.assertFalse(profiler.running)
+        files = sorted(os.listdir(self.directory))
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].endswith("-buildbot-mozilla-central.collapsed"))
+        with open(os.path.join(self.directory, files[1])) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith(" 2"))
+
+    def test_duration(self):
+        profiler = self.make_profiler(duration=10)
+        profiler.sample()
+        self.assertTrue(profiler.running)
+        self.now = 10
+        profiler.sample()
+        self.assertFalse(profiler.running)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
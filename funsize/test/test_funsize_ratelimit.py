@@ -0,0 +1,152 @@
+from unittest import TestCase
+import mock
+from urllib3.util.retry import Retry
+from funsize.ratelimit import RateLimiter, TokenBucket
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.bucket = TokenBucket("test", rate=2, burst=2, min_rate=0.5,
+                                  max_rate=3, increase=0.5, decrease=0.5,
+                                  clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst(self):
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertEqual(self.bucket.acquire(), 0.5)
+        self.assertEqual(self.bucket.waited, 0.5)
+
+    def test_refill(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+        self.clock.now += 10
+        self.assertEqual(self.bucket.tokens, 0)
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertEqual(self.bucket.tokens, 1)
+
+    def test_additive_increase(self):
+        for _ in range(5):
+            self.bucket.success()
+        self.assertEqual(self.bucket.rate, 3)
+
+    def test_multiplicative_decrease(self):
+        self.bucket.throttle()
+        self.assertEqual(self.bucket.rate, 1)
+        # Failures within a second count once
+        self.bucket.throttle()
+        self.assertEqual(self.bucket.rate, 1)
+        self.clock.now += 1
+        self.bucket.throttle()
+        self.assertEqual(self.bucket.rate, 0.5)
+        self.clock.now += 1
+        self.bucket.throttle()
+        self.assertEqual(self.bucket.rate, 0.5)
+        self.assertEqual(self.bucket.throttled, 4)
+
+    def test_retry_after(self):
+        self.bucket.throttle(retry_after=30)
+        self.assertEqual(self.bucket.acquire(), 30)
+
+
+class TestRateLimiter(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = RateLimiter(clock=self.clock, sleep=self.clock.sleep)
+
+    def test_classify(self):
+        self.assertEqual(self.limiter.classify(
+            "GET", "https://aus4-admin.mozilla.org/api/releases/"
+                   "Firefox-mozilla-central-nightly-20161019030208/builds/"
+                   "Linux_x86_64-gcc3/de")[0], "balrog-builds")
+        self.assertEqual(self.limiter.classify(
+            "GET", "https://treeherder.mozilla.org/api/project/"
+                   "mozilla-central/resultset/?revision=abc")[0],
+            "treeherder-resultset")
+        self.assertEqual(self.limiter.classify(
+            "PUT", "https://queue.taskcluster.net/v1/task/abc")[0],
+            "taskcluster-create-task")
+        self.assertEqual(self.limiter.classify(
+            "GET", "https://queue.taskcluster.net/v1/task/abc")[0],
+            "queue.taskcluster.net")
+        self.assertEqual(self.limiter.classify(
+            "POST", "https://queue.taskcluster.net/v1/task/abc/runs/0/"
+                    "claim")[0], "taskcluster-claim-task")
+
+    def test_tc_queue_url(self):
+        limiter = RateLimiter(
+            tc_queue_url="https://tc.example.com/api/queue/v1")
+        self.assertEqual(limiter.classify(
+            "PUT", "https://tc.example.com/api/queue/v1/task/abc")[0],
+            "taskcluster-create-task")
+        self.assertEqual(limiter.classify(
+            "PUT", "https://queue.taskcluster.net/v1/task/abc")[0],
+            "queue.taskcluster.net")
+
+    def test_shared_bucket(self):
+        url = "https://aus4-admin.mozilla.org/api/releases?names_only=1"
+        self.assertIs(self.limiter.bucket("GET", url),
+                      self.limiter.bucket("GET", url + "&product=Firefox"))
+
+    def test_custom_endpoints(self):
+        limiter = RateLimiter(endpoints=[{"name": "balrog", "url": "aus4",
+                                          "rate": 1}],
+                              default={"rate": 5})
+        self.assertEqual(limiter.bucket("GET", "https://aus4/a").rate, 1)
+        self.assertEqual(limiter.bucket("GET", "https://other/a").rate, 5)
+
+    def test_wrap(self):
+        response = mock.Mock(status_code=503,
+                             headers={"Retry-After": "10"})
+        response.raw.retries = None
+        send = self.limiter.wrap(mock.Mock(return_value=response))
+        request = mock.Mock(method="GET", url="https://balrog/api/releases")
+        self.assertIs(send(request, timeout=1), response)
+        bucket = self.limiter.buckets["balrog-releases"]
+        self.assertEqual(bucket.rate, 1)
+        self.assertEqual(bucket.blocked_until, self.clock.now + 10)
+
+    def test_wrap_connection_error(self):
+        send = self.limiter.wrap(mock.Mock(side_effect=IOError))
+        request = mock.Mock(method="GET", url="https://balrog/api/releases")
+        self.assertRaises(IOError, send, request)
+        self.assertEqual(self.limiter.buckets["balrog-releases"].throttled, 1)
+
+    def test_wrap_retry(self):
+        failed = mock.Mock(status_code=503, headers={})
+        ok = mock.Mock(status_code=200, headers={})
+        send = mock.Mock(side_effect=[failed, failed, ok])
+        wrapped = self.limiter.wrap(
+            send, retry=Retry(total=3, backoff_factor=1,
+                              status_forcelist=[503]))
+        request = mock.Mock(method="GET", url="https://balrog/api/releases")
+        self.assertIs(wrapped(request), ok)
+        self.assertEqual(send.call_count, 3)
+        bucket = self.limiter.buckets["balrog-releases"]
+        # Every attempt goes through the bucket
+        self.assertEqual(bucket.requests, 3)
+        self.assertEqual(bucket.throttled, 2)
+        self.assertEqual(failed.close.call_count, 2)
+
+    def test_wrap_retry_exhausted(self):
+        failed = mock.Mock(status_code=503, headers={})
+        send = mock.Mock(return_value=failed)
+        wrapped = self.limiter.wrap(
+            send, retry=Retry(total=2, status_forcelist=[503]))
+        request = mock.Mock(method="GET", url="https://balrog/api/releases")
+        self.assertIs(wrapped(request), failed)
+        self.assertEqual(send.call_count, 3)
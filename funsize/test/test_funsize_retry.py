@@ -0,0 +1,58 @@
+from unittest import TestCase
+import mock
+from funsize.retry import RetryQueues, ATTEMPTS_HEADER, ERROR_HEADER, \
+    ROUTING_KEY_HEADER, SUBMITTED_HEADER, original_routing_key
+
+
+def make_message(headers=None, routing_key="build.x.finished"):
+    return mock.Mock(headers=headers or {}, body=b"{}",
+                     content_type="application/json",
+                     content_encoding="utf-8",
+                     delivery_info={"routing_key": routing_key})
+
+
+class TestRetryQueues(TestCase):
+
+    def setUp(self):
+        self.retry = RetryQueues("exchange/u/funsize-retry", attempts=3,
+                                 delay=10, factor=2, max_delay=15)
+        self.producer = mock.Mock()
+
+    def test_delays(self):
+        self.assertEqual(self.retry.delays, [10, 15])
+
+    def test_first_retry(self):
+        message = make_message()
+        target = self.retry.republish(self.producer, message, "queue/u/q",
+                                      "ValueError: boom")
+        self.assertEqual(target, "queue/u/q-retry-10")
+        kwargs = self.producer.publish.call_args[1]
+        self.assertEqual(kwargs["exchange"], "exchange/u/funsize-retry")
+        self.assertEqual(kwargs["headers"][ATTEMPTS_HEADER], 1)
+        self.assertEqual(kwargs["headers"][ROUTING_KEY_HEADER],
+                         "build.x.finished")
+
+    def test_submitted_partials(self):
+        message = make_message({SUBMITTED_HEADER: ["b"]})
+        self.retry.republish(self.producer, message, "queue/u/q",
+                             "ValueError: boom", submitted={"a"})
+        headers = self.producer.publish.call_args[1]["headers"]
+        self.assertEqual(headers[SUBMITTED_HEADER], ["a", "b"])
+
+    def test_dead_letter(self):
+        message = make_message({ATTEMPTS_HEADER: 3,
+                                ROUTING_KEY_HEADER: "build.x.finished"},
+                               routing_key="queue/u/q")
+        target = self.retry.republish(self.producer, message, "queue/u/q",
+                                      "ValueError: boom")
+        self.assertEqual(target, "queue/u/q-dead")
+        headers = self.producer.publish.call_args[1]["headers"]
+        self.assertEqual(headers[ERROR_HEADER], "ValueError: boom")
+        self.assertEqual(headers[ROUTING_KEY_HEADER], "build.x.finished")
+
+    def test_original_routing_key(self):
+        self.assertEqual(original_routing_key(make_message()),
+                         "build.x.finished")
+        message = make_message({ROUTING_KEY_HEADER: "build.y.finished"},
+                               routing_key="queue/u/q")
+        self.assertEqual(original_routing_key(message), "build.y.finished")
@@ -0,0 +1,65 @@
+import signal
+import time
+from unittest import TestCase
+import mock
+from funsize.supervisor import Supervisor
+
+
+def exit_now():
+    pass
+
+
+def sleep_forever():
+    while True:
+        time.sleep(1)
+
+
+class TestSupervisor(TestCase):
+
+    def test_restart_crashed(self):
+        s = Supervisor(target=exit_now, processes=2, min_uptime=0)
+        s.check_children()
+        first = [p.pid for p in s.children]
+        for p in s.children:
+            p.join()
+        s.check_children()
+        second = [p.pid for p in s.children]
+        for p in s.children:
+            p.join()
+        self.assertEqual(len(second), 2)
+        self.assertNotEqual(first, second)
+
+    def test_crash_loop_backoff(self):
+        s = Supervisor(target=exit_now, processes=1, min_uptime=60)
+        s.check_children()
+        s.children[0].join()
+        s.check_children()
+        self.assertIsNone(s.children[0])
+        self.assertEqual(s.restart_delays[0], 1)
+
+    def test_shutdown(self):
+        s = Supervisor(target=sleep_forever, processes=2,
+                       shutdown_timeout=10)
+        s.check_children()
+        s.shutdown()
+        self.assertTrue(all(not p.is_alive() for p in s.children))
+
+    @mock.patch("os.kill")
+    def test_forward_signal(self, kill):
+        s = Supervisor(target=sleep_forever, processes=2)
+        s.children = [mock.Mock(pid=10), None]
+        s.children[0].is_alive.return_value = True
+        s.forward_signal(signal.SIGUSR2, None)
+        kill.assert_called_once_with(10, signal.SIGUSR2)
+
+    def test_child_ignores_sigusr2(self):
+        s = Supervisor(target=sleep_forever, processes=1,
+                       shutdown_timeout=10)
+        s.check_children()
+        try:
+            time.sleep(0.5)
+            s.forward_signal(signal.SIGUSR2, None)
+            time.sleep(0.5)
+            self.assertTrue(s.children[0].is_alive())
+        finally:
+            s.shutdown()
@@ -0,0 +1,149 @@
+import threading
+from unittest import TestCase
+import mock
+from funsize.transport import Transport
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    # Keep-alive connections block their handler thread until closed
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FlakyHandler(Handler):
+    # Fails every other request
+    paths = []
+
+    def do_POST(self):
+        self.paths.append(self.path)
+        self.send_response(503 if len(self.paths) % 2 else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_HEAD = do_POST
+
+
+class ThrottlingHandler(Handler):
+
+    def do_GET(self):
+        self.send_response(429)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class TestTransport(TestCase):
+
+    def test_default_timeout(self):
+        t = Transport(connect_timeout=1, read_timeout=2)
+        with mock.patch.object(t.session, "request") as request:
+            t.get("https://localhost/")
+        self.assertEqual(request.call_args[1]["timeout"], (1, 2))
+
+    def test_explicit_timeout(self):
+        t = Transport()
+        with mock.patch.object(t.session, "request") as request:
+            t.get("https://localhost/", timeout=5)
+        self.assertEqual(request.call_args[1]["timeout"], 5)
+
+    def test_host_pool_size(self):
+        t = Transport(host_pool_sizes={"balrog": 8})
+        adapter = t.session.get_adapter("https://balrog/api")
+        self.assertEqual(adapter._pool_maxsize, 8)
+
+    def test_connection_reuse(self):
+        server = Server(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        t = Transport()
+        try:
+            url = "http://127.0.0.1:{}/".format(server.server_port)
+            for _ in range(3):
+                self.assertEqual(t.get_json(url), {"ok": True})
+            stats = t.stats()["127.0.0.1"]
+            self.assertEqual(stats["requests"], 3)
+            self.assertEqual(stats["connections"], 1)
+        finally:
+            t.session.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_rate_limits(self):
+        server = Server(("127.0.0.1", 0), ThrottlingHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        t = Transport(rate_limits={"enabled": True, "default": {"rate": 4}})
+        try:
+            url = "http://127.0.0.1:{}/".format(server.server_port)
+            self.assertEqual(t.get(url).status_code, 429)
+            bucket = t.rate_limiter.buckets["127.0.0.1"]
+            self.assertEqual(bucket.requests, 1)
+            self.assertEqual(bucket.rate, 2)
+        finally:
+            t.session.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_rate_limits_disabled(self):
+        self.assertIsNone(Transport(rate_limits={"enabled": False})
+                          .rate_limiter)
+
+    def test_idempotent_prefixes(self):
+        server = Server(("127.0.0.1", 0), FlakyHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        root = "http://127.0.0.1:{}".format(server.server_port)
+        t = Transport(backoff_factor=0,
+                      idempotent_prefixes=[root + "/queue/"])
+        try:
+            del FlakyHandler.paths[:]
+            self.assertEqual(t.request("POST", root + "/queue/claim")
+                             .status_code, 200)
+            self.assertEqual(FlakyHandler.paths, ["/queue/claim"] * 2)
+            del FlakyHandler.paths[:]
+            self.assertEqual(t.request("POST", root + "/other")
+                             .status_code, 503)
+            self.assertEqual(FlakyHandler.paths, ["/other"])
+        finally:
+            t.session.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_probe_not_retried(self):
+        server = Server(("127.0.0.1", 0), FlakyHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        t = Transport(backoff_factor=0)
+        try:
+            del FlakyHandler.paths[:]
+            url = "http://127.0.0.1:{}/a.mar".format(server.server_port)
+            self.assertEqual(t.probe(url, timeout=1).status_code, 503)
+            self.assertEqual(FlakyHandler.paths, ["/a.mar"])
+        finally:
+            t.session.close()
+            t._probe_session.close()
+            server.shutdown()
+            server.server_close()
@@ -1,7 +1,9 @@
 from unittest import TestCase
 from jose import jwt, jws
 from jose.constants import ALGORITHMS
-from funsize.utils import properties_to_dict, sign_task
+import mock
+from funsize.utils import properties_to_dict, sign_task, \
+    revision_to_revision_hash
 from hypothesis import given
 import hypothesis.strategies as st
 from . import PVT_KEY, PUB_KEY, OTHER_PUB_KEY
@@ -31,6 +33,28 @@ class TestPropertiesToDict(TestCase):
                              properties_to_dict(props))
 
 
+class TestRevisionToRevisionHash(TestCase):
+
+    @mock.patch("funsize.utils.fetch_json")
+    def test_not_ingested_yet(self, fetch_json):
+        fetch_json.side_effect = [{"results": []}, {"results": []},
+                                  {"results": [{"revision_hash": "h"}]}]
+        sleep = mock.Mock()
+        self.assertEqual(revision_to_revision_hash(
+            "https://th/api", "oak", "a" * 40, sleep=sleep), "h")
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [5, 7.5])
+
+    @mock.patch("funsize.utils.fetch_json")
+    def test_not_found(self, fetch_json):
+        fetch_json.return_value = {"results": []}
+        sleep = mock.Mock()
+        self.assertRaises(RuntimeError, revision_to_revision_hash,
+                          "https://th/api", "oak", "a" * 40, attempts=3,
+                          sleep=sleep)
+        self.assertEqual(fetch_json.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+
 class TestTaskSigning(TestCase):
 
     def test_task_id(self):
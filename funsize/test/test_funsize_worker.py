@@ -1,6 +1,13 @@
+import subprocess
+import sys
 from unittest import TestCase, skipUnless
-from funsize.worker import FunsizeWorker, STAGING_BRANCHES, PRODUCTION_BRANCHES
+from funsize.worker import FunsizeWorker, STAGING_BRANCHES, \
+    PRODUCTION_BRANCHES, find_balrog_props_task
 from funsize.balrog import BalrogClient
+from funsize.shards import Shard
+from funsize.profiler import SamplingProfiler
+from funsize.dedup import partial_key
+from funsize.retry import RetryQueues, SUBMITTED_HEADER
 import mock
 from . import PVT_KEY
 
@@ -72,3 +79,322 @@ class TestFunsizeWorkerFromTemplate(TestCase):
         """Ensure MAR signing format"""
         tg = self.generate_task_graph("branch")
         assert 'project:releng:signing:format:mar_sha384' in tg["tasks"][2]["task"]["scopes"]
+
+
+class TestPackage(TestCase):
+
+    def test_exports(self):
+        import funsize
+        self.assertIs(funsize.FunsizeWorker, FunsizeWorker)
+        self.assertIs(funsize.BalrogClient, BalrogClient)
+
+    @skipUnless(sys.version_info >= (3, 7), "needs module __getattr__")
+    def test_utils_import_light(self):
+        subprocess.check_call([
+            sys.executable, "-c",
+            "import sys, funsize.utils; assert 'kombu' not in sys.modules"])
+
+
+class TestFindBalrogProps(TestCase):
+
+    def test_props_through_transport(self):
+        queue = mock.Mock()
+        queue.task.return_value = {
+            "payload": {"env": {"GECKO_HEAD_REV": "abc"}}}
+        queue.listLatestArtifacts.return_value = {"artifacts": [
+            {"name": "public/build/target.complete.mar"},
+            {"name": "public/build/balrog_props.json"}]}
+        queue.buildUrl.return_value = "https://queue/props"
+        props = {"properties": {"appName": "Firefox"}}
+        with mock.patch("funsize.transport.get_transport") as get_transport:
+            get_transport.return_value.get_json.return_value = props
+            self.assertEqual(find_balrog_props_task(["tid"], queue),
+                             ("abc", props))
+        queue.buildUrl.assert_called_once_with(
+            "getLatestArtifact", "tid", "public/build/balrog_props.json")
+        get_transport.return_value.get_json.assert_called_once_with(
+            "https://queue/props")
+        self.assertFalse(queue.getLatestArtifact.called)
+
+
+class TestFunsizeWorkerShards(TestCase):
+
+    def make_worker(self, shards=None, consume_shards=None):
+        return FunsizeWorker(connection=None,
+                             bb_exchange="bb_exchange",
+                             tc_exchange="tc_exchange",
+                             queue_name="queue/u/funsize",
+                             tc_queue="tc_queue", balrog_client=None,
+                             s3_info=None, th_api_root=None,
+                             balrog_worker_api_root=None, pvt_key=None,
+                             shards=shards, consume_shards=consume_shards)
+
+    def test_no_shards(self):
+        w = self.make_worker()
+        names = set(q.name for q in w.queues)
+        self.assertEqual(names, set(["queue/u/funsize"]))
+        self.assertEqual(len(w.queues),
+                         len(w.bb_routing_keys) + len(w.tc_routing_keys))
+
+    def test_bindings_split(self):
+        shards = [Shard("central", branches=["mozilla-central"]),
+                  Shard("rest")]
+        w = self.make_worker(shards)
+        bindings = w.shard_bindings
+        self.assertTrue(all("mozilla-central" in k
+                            for k in bindings["central"]["bb"]))
+        self.assertFalse(any("mozilla-central" in k
+                             for k in bindings["rest"]["bb"]))
+        self.assertEqual(
+            len(bindings["central"]["bb"]) + len(bindings["rest"]["bb"]),
+            len(w.bb_routing_keys))
+        self.assertEqual(
+            len(bindings["central"]["tc"]) + len(bindings["rest"]["tc"]),
+            len(w.tc_routing_keys))
+
+    def test_consume_subset(self):
+        shards = [Shard("central", branches=["mozilla-central"]),
+                  Shard("rest")]
+        w = self.make_worker(shards, consume_shards=["rest"])
+        names = set(q.name for q in w.queues)
+        self.assertEqual(names, set(["queue/u/funsize-rest"]))
+
+    def test_unknown_shard(self):
+        self.assertRaises(ValueError, self.make_worker, [Shard("a")], ["b"])
+
+    def test_queues_cached(self):
+        w = self.make_worker()
+        self.assertIs(w.queues, w.queues)
+
+    def test_compact_filter(self):
+        w = self.make_worker()
+        w.compact_bindings = True
+        self.assertEqual(len(w.queues), 1 + len(w.tc_routing_keys))
+        self.assertTrue(w.is_interesting_routing_key(
+            "build.mozilla-central-linux-l10n-nightly-3.12.finished"))
+        self.assertFalse(w.is_interesting_routing_key(
+            "build.try-linux-l10n-nightly-3.12.finished"))
+
+    def test_compact_fallback_no_filter(self):
+        shards = [Shard("central", branches=["mozilla-central"]),
+                  Shard("rest")]
+        w = self.make_worker(shards)
+        w.compact_bindings = True
+        self.assertFalse(w.filter_bb_messages)
+        w = self.make_worker()
+        w.compact_bindings = True
+        self.assertTrue(w.filter_bb_messages)
+
+    def test_get_builds_release_limit(self):
+        w = self.make_worker()
+        w.balrog_client = mock.Mock()
+        w.balrog_client.iter_releases.return_value = iter(["r1", "r2"])
+        w.balrog_client.get_build.return_value = {
+            "completes": [{"fileUrl": "https://from/mar"}]}
+        builds = w.get_builds("Firefox", "linux", "oak", "de",
+                              "https://to/mar", count=4, release_limit=2)
+        self.assertEqual(len(builds), 2)
+        w.balrog_client.iter_releases.assert_called_once_with(
+            "Firefox", "oak", limit=2)
+
+    def test_get_builds_from_store(self):
+        from funsize.prefetch import BalrogStore
+        w = self.make_worker()
+        w.balrog_client = mock.Mock()
+        w.balrog_store = BalrogStore()
+        w.balrog_store.set_releases("Firefox", "oak", ["r2", "r1"])
+        w.balrog_store.set_build("r2", "linux", "de", None)
+        w.balrog_store.set_build(
+            "r1", "linux", "de", {"completes": [{"fileUrl": "https://r1"}]})
+        builds = w.get_builds("Firefox", "linux", "oak", "de",
+                              "https://to/mar")
+        self.assertEqual(builds, [{"completes": [{"fileUrl": "https://r1"}]}])
+        self.assertFalse(w.balrog_client.iter_releases.called)
+        self.assertFalse(w.balrog_client.get_build.called)
+
+    def test_backpressure_pause_resume(self):
+        w = self.make_worker()
+        w.backpressure = mock.Mock()
+        consumer = mock.Mock()
+        w.on_consume_ready(None, None, [consumer])
+        w.backpressure.should_pause.return_value = True
+        w.on_iteration()
+        w.on_iteration()
+        consumer.cancel.assert_called_once_with()
+        w.backpressure.should_pause.return_value = False
+        w.on_iteration()
+        consumer.consume.assert_called_once_with()
+
+
+class TestFunsizeWorkerBatch(TestCase):
+
+    def make_worker(self, batch_size):
+        w = FunsizeWorker(connection=None, bb_exchange="bb_exchange",
+                          tc_exchange="tc_exchange",
+                          queue_name="queue/u/funsize", tc_queue="tc_queue",
+                          balrog_client=None, s3_info=None, th_api_root=None,
+                          balrog_worker_api_root=None, pvt_key=None,
+                          batch_size=batch_size)
+        w.submit_task_graph = mock.Mock()
+        return w
+
+    def plan(self, w, branch, locale):
+        def dispatch(body, message):
+            w.schedule(dict(branch=branch, platform="linux",
+                            update_number=1, locale_desc=locale,
+                            extra=[]), locales=[locale])
+        return dispatch
+
+    def test_priority_across_messages(self):
+        w = self.make_worker(batch_size=2)
+        first, second = mock.Mock(delivery_tag=1), mock.Mock(delivery_tag=2)
+        w.dispatch_message = self.plan(w, "mozilla-aurora", "de")
+        w.process_message(None, first)
+        self.assertFalse(w.submit_task_graph.called)
+        self.assertFalse(first.ack.called)
+        w.dispatch_message = self.plan(w, "mozilla-central", "en-US")
+        w.process_message(None, second)
+        submitted = [c[1]["branch"]
+                     for c in w.submit_task_graph.call_args_list]
+        self.assertEqual(submitted, ["mozilla-central", "mozilla-aurora"])
+        first.ack.assert_called_once_with()
+        second.ack.assert_called_once_with()
+
+    def test_idle_flush(self):
+        w = self.make_worker(batch_size=10)
+        message = mock.Mock(delivery_tag=1)
+        w.dispatch_message = self.plan(w, "mozilla-central", "en-US")
+        w.process_message(None, message)
+        # a message was received since the last iteration
+        w.on_iteration()
+        self.assertFalse(message.ack.called)
+        # nothing received during the last drain
+        w.on_iteration()
+        self.assertEqual(w.submit_task_graph.call_count, 1)
+        message.ack.assert_called_once_with()
+
+    def test_failed_submission_acked(self):
+        w = self.make_worker(batch_size=1)
+        w.submit_task_graph.side_effect = Exception
+        message = mock.Mock(delivery_tag=1)
+        w.dispatch_message = self.plan(w, "mozilla-central", "en-US")
+        w.process_message(None, message)
+        message.ack.assert_called_once_with()
+
+    def test_failed_message_retried(self):
+        w = self.make_worker(batch_size=1)
+        w.retry_queues = mock.Mock()
+        w.dispatch_message = mock.Mock(side_effect=ValueError("boom"))
+        message = mock.Mock(delivery_tag=1, headers={})
+        w.process_message(None, message, queue_name="queue/u/funsize")
+        w.retry_queues.republish.assert_called_once_with(
+            None, message, "queue/u/funsize", "ValueError: boom",
+            submitted=set())
+        message.ack.assert_called_once_with()
+
+    def test_retry_submits_failed_graphs_only(self):
+        w = self.make_worker(batch_size=1)
+        w.limits = {"default": {"per_chunk": 1, "target_runtime": None}}
+        w.retry_queues = RetryQueues("exchange/u/funsize-retry")
+        w.producer = mock.Mock()
+        w.get_builds = lambda product, platform, branch, locale, *args: [
+            {"completes": [{"fileUrl": "https://from/" + locale}]}]
+        w.dispatch_message = lambda body, message: w.create_partials(
+            "Firefox", "oak", "linux", ["de", "fr"], "rev",
+            mar_urls={"de": "https://to/de", "fr": "https://to/fr"},
+            mar_signing_format="mar")
+
+        def submit(**graph):
+            if graph["locale_desc"] == "fr":
+                raise Exception("createTask failed")
+        w.submit_task_graph.side_effect = submit
+        message = mock.Mock(delivery_tag=1, headers={},
+                            delivery_info={"routing_key": "build.x"})
+        w.process_message(None, message, queue_name="queue/u/funsize")
+        headers = w.producer.publish.call_args[1]["headers"]
+        self.assertEqual(headers[SUBMITTED_HEADER],
+                         [partial_key("https://from/de", "https://to/de", "de")])
+
+        w.submit_task_graph.reset_mock()
+        w.submit_task_graph.side_effect = None
+        retried = mock.Mock(delivery_tag=2, headers=headers,
+                            delivery_info={"routing_key": "queue/u/funsize"})
+        w.process_message(None, retried, queue_name="queue/u/funsize")
+        submitted = [c[1]["locale_desc"]
+                     for c in w.submit_task_graph.call_args_list]
+        self.assertEqual(submitted, ["fr"])
+        retried.ack.assert_called_once_with()
+
+    def test_profiler_submit_tag(self):
+        w = self.make_worker(batch_size=2)
+        w.profiler = SamplingProfiler("/nonexistent")
+        tags = []
+        w.submit_task_graph.side_effect = \
+            lambda **graph: tags.append(w.profiler.tag)
+        w.dispatch_message = self.plan(w, "mozilla-central", "en-US")
+        w.process_message(None, mock.Mock(delivery_tag=1))
+        w.process_message(None, mock.Mock(delivery_tag=2))
+        self.assertEqual(tags, ["submit-mozilla-central"] * 2)
+        self.assertEqual(w.profiler.tag, "idle")
+
+    def test_no_graphs_acked(self):
+        w = self.make_worker(batch_size=10)
+        message = mock.Mock(delivery_tag=1)
+        w.dispatch_message = mock.Mock()
+        w.process_message(None, message)
+        message.ack.assert_called_once_with()
+
+
+class TestFunsizeWorkerStreaming(TestCase):
+
+    def test_streaming(self):
+        w = FunsizeWorker(connection=None, bb_exchange="bb_exchange",
+                          tc_exchange="tc_exchange",
+                          queue_name="queue/u/funsize", tc_queue="tc_queue",
+                          balrog_client=None, s3_info=None, th_api_root=None,
+                          balrog_worker_api_root=None, pvt_key=None,
+                          limits={"default": {"streaming": True,
+                                              "per_chunk": 2,
+                                              "target_runtime": None}})
+        events = []
+
+        def get_builds(product, platform, branch, locale, *args):
+            events.append(locale)
+            return [{"completes": [{"fileUrl": "https://from/" + locale}]}]
+
+        w.get_builds = get_builds
+        w.submit_task_graph = mock.Mock(
+            side_effect=lambda **graph: events.append(graph["locale_desc"]))
+        w.create_partials("Firefox", "oak", "linux", ["de", "fr", "ka"],
+                          "rev", mar_urls={}, mar_signing_format="mar")
+        self.assertEqual(events, ["de", "fr", "de_fr", "ka", "ka"])
+
+    def test_streaming_in_batch(self):
+        w = FunsizeWorker(connection=None, bb_exchange="bb_exchange",
+                          tc_exchange="tc_exchange",
+                          queue_name="queue/u/funsize", tc_queue="tc_queue",
+                          balrog_client=None, s3_info=None, th_api_root=None,
+                          balrog_worker_api_root=None, pvt_key=None,
+                          batch_size=10,
+                          limits={"default": {"streaming": True,
+                                              "per_chunk": 1,
+                                              "target_runtime": None}})
+        events = []
+
+        def get_builds(product, platform, branch, locale, *args):
+            events.append(locale)
+            return [{"completes": [{"fileUrl": "https://from/" + locale}]}]
+
+        w.get_builds = get_builds
+        w.submit_task_graph = mock.Mock(
+            side_effect=lambda **graph: events.append(graph["locale_desc"]))
+        w.dispatch_message = lambda body, message: w.create_partials(
+            "Firefox", "oak", "linux", ["de", "fr"], "rev",
+            mar_urls={"de": "https://to/de", "fr": "https://to/fr"},
+            mar_signing_format="mar")
+        message = mock.Mock(delivery_tag=1)
+        w.process_message(None, message)
+        self.assertEqual(events, ["de", "de", "fr", "fr"])
+        self.assertFalse(message.ack.called)
+        w.on_consume_end(None, None)
+        message.ack.assert_called_once_with()
@@ -0,0 +1,190 @@
+import logging
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+
+from funsize.codec import response_json
+
+log = logging.getLogger(__name__)
+
+_transport = None
+
+
+def get_transport():
+    """Returns the transport shared by all HTTP clients of the process.
+
+    It is created on first use, so forked workers get their own pools.
+    """
+    global _transport
+    if _transport is None:
+        _transport = Transport()
+    return _transport
+
+
+def set_transport(transport):
+    global _transport
+    _transport = transport
+
+
+class Transport(object):
+
+    def __init__(self, pool_connections=10, pool_maxsize=4,
+                 host_pool_sizes=None, connect_timeout=10, read_timeout=60,
+                 retries=5, backoff_factor=2,
+                 status_forcelist=(500, 502, 503, 504), rate_limits=None,
+                 idempotent_prefixes=None):
+        """Keep-alive HTTP transport shared by the Balrog, Treeherder and
+        Taskcluster clients.
+
+        :param pool_connections: number of hosts to keep pools for
+        :param pool_maxsize: connections kept per host
+        :param host_pool_sizes: {host: connections}, overrides pool_maxsize
+        :param connect_timeout: seconds to establish a connection
+        :param read_timeout: seconds to wait for a response
+        :param retries: retries on connection errors and statuses in
+            status_forcelist. Only idempotent methods are retried, POST is
+            not, except under idempotent_prefixes. The clients using the
+            transport do not retry these errors on their own.
+        :param backoff_factor: exponential backoff between retries, the
+            first retry is immediate and the n-th one sleeps
+            backoff_factor * 2 ** (n - 1) seconds, capped at 120 seconds
+        :param rate_limits: funsize.ratelimit.RateLimiter parameters,
+            requests are rate limited per endpoint class when "enabled" is
+            set, including the Taskcluster ones sent through the session
+        :param idempotent_prefixes: URL prefixes of APIs whose requests are
+            all safe to retry, the POST ones included, e.g. the Taskcluster
+            queue and index
+        """
+        import requests
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self._probe_session = None
+        self.rate_limiter = None
+        rate_limits = dict(rate_limits or {})
+        if rate_limits.pop("enabled", False):
+            from funsize.ratelimit import RateLimiter
+            self.rate_limiter = RateLimiter(**rate_limits)
+        self.retry = self._make_retry(retries, backoff_factor,
+                                      status_forcelist)
+        self.retry_all_methods = self._make_retry(
+            retries, backoff_factor, status_forcelist, all_methods=True)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "funsize"
+        self.adapters = []
+        default = self._make_adapter(pool_connections, pool_maxsize)
+        self.session.mount("https://", default)
+        self.session.mount("http://", default)
+        for host, size in (host_pool_sizes or {}).items():
+            adapter = self._make_adapter(1, size)
+            self.session.mount("https://{}/".format(host), adapter)
+            self.session.mount("http://{}/".format(host), adapter)
+        for prefix in idempotent_prefixes or ():
+            size = (host_pool_sizes or {}).get(urlsplit(prefix).hostname,
+                                               pool_maxsize)
+            self.session.mount(prefix, self._make_adapter(
+                1, size, retry=self.retry_all_methods))
+        self.requests = 0
+
+    @staticmethod
+    def _make_retry(retries, backoff_factor, status_forcelist,
+                    all_methods=False):
+        from requests.packages.urllib3.util.retry import Retry
+        kwargs = dict(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=status_forcelist)
+        if all_methods:
+            # A false value retries every method
+            try:
+                Retry(allowed_methods=False)
+                kwargs["allowed_methods"] = False
+            except TypeError:
+                kwargs["method_whitelist"] = False
+        try:
+            # Return the last response instead of raising, so callers get
+            # the usual requests.HTTPError from raise_for_status()
+            return Retry(raise_on_status=False, **kwargs)
+        except TypeError:
+            return Retry(**kwargs)
+
+    def _make_adapter(self, pool_connections, pool_maxsize, retry=None):
+        from requests.adapters import HTTPAdapter
+        retry = self.retry if retry is None else retry
+        max_retries = retry
+        if self.rate_limiter and retry:
+            # Statuses are retried by the rate limiter, so every attempt
+            # goes through the token bucket
+            try:
+                max_retries = retry.new(status_forcelist=(),
+                                        respect_retry_after_header=False)
+            except TypeError:
+                max_retries = retry.new(status_forcelist=())
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=max_retries)
+        if self.rate_limiter:
+            adapter.send = self.rate_limiter.wrap(adapter.send,
+                                                  retry=retry or None)
+        self.adapters.append(adapter)
+        return adapter
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        self.requests += 1
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def probe(self, url, timeout=5):
+        """HEAD request for optional metadata: a single attempt with a short
+        timeout, so a slow host costs at most `timeout` seconds.
+        """
+        if self._probe_session is None:
+            import requests
+            session = requests.Session()
+            session.headers["User-Agent"] = "funsize"
+            adapter = self._make_adapter(self.pool_connections,
+                                         self.pool_maxsize, retry=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._probe_session = session
+        self.requests += 1
+        return self._probe_session.head(url, allow_redirects=True,
+                                        timeout=timeout)
+
+    def get_json(self, url, params=None, **kwargs):
+        headers = {"Accept": "application/json"}
+        headers.update(kwargs.pop("headers", {}))
+        response = self.get(url, params=params, headers=headers, **kwargs)
+        response.raise_for_status()
+        return response_json(response)
+
+    def stats(self):
+        """Connection reuse statistics per host.
+
+        :return: {host: {"connections": new connections opened,
+                         "requests": requests sent}}
+        """
+        stats = {}
+        for adapter in self.adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host_stats = stats.setdefault(pool.host, {"connections": 0,
+                                                          "requests": 0})
+                host_stats["connections"] += pool.num_connections
+                host_stats["requests"] += pool.num_requests
+        return stats
+
+    def log_stats(self):
+        for host, s in sorted(self.stats().items()):
+            log.info("%s: %s requests over %s connections", host,
+                     s["requests"], s["connections"])
+        if self.rate_limiter:
+            self.rate_limiter.log_stats()
@@ -1,14 +1,14 @@
 import os
-import requests
-import redo
 import logging
 import time
-from taskcluster import encryptEnvVar
-from jose import jws
-from jose.constants import ALGORITHMS
 
 log = logging.getLogger(__name__)
 
+# jose.constants.ALGORITHMS.RS512, kept here to avoid importing jose
+RS512 = "RS512"
+# Services of this deployment have their own host
+LEGACY_TC_ROOT_URL = "https://taskcluster.net"
+
 
 def properties_to_dict(props):
     """Convert properties tuple into dict"""
@@ -20,13 +20,23 @@ def properties_to_dict(props):
 
 
 def fetch_json(url, params=None):
-    headers = {
-        'Accept': 'application/json',
-        'User-Agent': 'funsize',
-    }
-    response = requests.get(url, params=params, headers=headers, timeout=30)
-    response.raise_for_status()
-    return response.json()
+    from funsize.transport import get_transport
+    return get_transport().get_json(url, params=params)
+
+
+def taskcluster_service_url(tc_opts, service, version="v1"):
+    """Base URL of a Taskcluster service API
+
+    >>> taskcluster_service_url({}, "queue")
+    'https://queue.taskcluster.net/v1'
+    >>> taskcluster_service_url({"rootUrl": "https://tc.example.com/"},
+    ...                         "index")
+    'https://tc.example.com/api/index/v1'
+    """
+    root_url = (tc_opts.get("rootUrl") or LEGACY_TC_ROOT_URL).rstrip("/")
+    if root_url == LEGACY_TC_ROOT_URL:
+        return "https://{}.taskcluster.net/{}".format(service, version)
+    return "{}/api/{}/{}".format(root_url, service, version)
 
 
 def buildbot_to_treeherder(platform):
@@ -41,36 +51,49 @@ def buildbot_to_treeherder(platform):
     return m[platform]
 
 
-def revision_to_revision_hash(th_api_root, branch, revision):
+def revision_to_revision_hash(th_api_root, branch, revision, attempts=5,
+                              sleeptime=5, max_sleeptime=30,
+                              sleep=time.sleep):
+    """Looks up the Treeherder revision hash of a push.
+
+    Connection errors and server errors are retried by the transport. A
+    push Treeherder has not ingested yet comes back as an empty result set,
+    that lookup is retried here up to `attempts` times, sleeping sleeptime,
+    then 1.5 times longer every attempt, at most max_sleeptime seconds.
+    """
     url = "{th_api_root}/project/{branch}/resultset/".format(
         th_api_root=th_api_root, branch=branch
     )
     # Use short revision for treeherder API
     revision = revision[:12]
     params = {"revision": revision}
-    for _ in redo.retrier(sleeptime=5, max_sleeptime=30):
-        params_str = "&".join("=".join([k, str(v)])
-                              for k, v in params.iteritems())
+    for attempt in range(1, attempts + 1):
+        log.debug("Connecting to %s?revision=%s", url, revision)
+        result_sets = fetch_json(url, params=params)
         try:
-            log.debug("Connecting to %s?%s", url, params_str)
-            result_sets = fetch_json(url, params=params)
             return result_sets["results"][0]["revision_hash"]
-        except:
-            log.exception("Failed to connect to %s?%s", url, params_str)
-    else:
-        raise RuntimeError("Cannot fetch revision hash for {} {}".format(
-            branch, revision))
+        except (KeyError, IndexError):
+            if attempt == attempts:
+                break
+            delay = min(sleeptime * 1.5 ** (attempt - 1), max_sleeptime)
+            log.info("Revision %s of %s not found in Treeherder yet, "
+                     "retrying in %.0fs", revision, branch, delay)
+            sleep(delay)
+    raise RuntimeError("Cannot fetch revision hash for {} {}".format(
+        branch, revision))
 
 
 def encryptEnvVar_wrapper(*args, **kwargs):
     """Wrap encryptEnvVar and pass key file path"""
+    from taskcluster import encryptEnvVar
     return encryptEnvVar(
         *args, keyFile=os.path.join(os.path.dirname(__file__),
                                     "data", "docker-worker-pub.pem"),
         **kwargs)
 
 
-def sign_task(task_id, pvt_key, valid_for=3600, algorithm=ALGORITHMS.RS512):
+def sign_task(task_id, pvt_key, valid_for=3600, algorithm=RS512):
+    from jose import jws
     # reserved JWT claims, to be verified
     # Issued At
     iat = int(time.time())
@@ -3,23 +3,26 @@ import logging
 import time
 import os
 import re
-import json
-import requests
-import yaml
-from collections import defaultdict
-from kombu import Exchange, Queue
+from collections import defaultdict, OrderedDict
+from kombu import Exchange, Producer, Queue
 from kombu.mixins import ConsumerMixin
-from taskcluster import slugId, stringDate, fromNow, stableSlugId
-from taskcluster.exceptions import TaskclusterFailure
-# Already importing Queue from kombu, above.
-from taskcluster import Queue as tc_Queue
-from jinja2 import Template, StrictUndefined
-from more_itertools import chunked
 from functools import partial
+# taskcluster, requests, jinja2, yaml and more_itertools are imported where
+# they are used, they are slow to import and not needed to start consuming.
 
 
+from funsize import codec
 from funsize.utils import properties_to_dict, revision_to_revision_hash, \
     buildbot_to_treeherder, encryptEnvVar_wrapper, sign_task
+from funsize.shards import Shard, assign_bindings
+from funsize.priority import PriorityScheduler
+from funsize.bindings import BB_WILDCARD, plan_bindings, reconcile, \
+    topic_regex
+from funsize.dedup import partial_key
+from funsize.packing import CostModel, get_limits, pack
+from funsize.retry import original_routing_key, submitted_partials
+from funsize.latency import published_at
+from funsize.logs import format_fields
 
 log = logging.getLogger(__name__)
 
@@ -34,11 +37,20 @@ BUILDERS = [
     r'^Firefox {branch} (linux|linux64|win32|win64|macosx64) l10n nightly-\d+',
     r'^Firefox {branch} (linux|linux64|win32|win64|macosx64) l10n nightly',
 ]
+# TODO: move to configs
+BB_JOBS = [
+    'build.{branch}-{platform}-nightly.*.finished',
+    # old style l10n repacks
+    'build.{branch}-{platform}-l10n-nightly.*.finished',
+] + [
+    'build.{branch}-{platform}-l10n-nightly-%d.*.finished' % chunk
+    for chunk in range(1, 21)
+]
 
 
-def find_all_signing_formats(task):
+def find_all_signing_formats(task, queue):
+    from taskcluster.exceptions import TaskclusterFailure
     log.info("Looking for signing formats in %s", task)
-    queue = tc_Queue()
     formats = []
     try:
         task_def = queue.task(task)
@@ -51,8 +63,8 @@ def find_all_signing_formats(task):
     return formats
 
 
-def get_default_signing_format(task):
-    formats = find_all_signing_formats(task)
+def get_default_signing_format(task, queue):
+    formats = find_all_signing_formats(task, queue)
     priority_list = ['mar_sha384', 'mar']
     for fmt in priority_list:
         if fmt in formats:
@@ -61,9 +73,22 @@ def get_default_signing_format(task):
     return 'mar_sha384'
 
 
-def find_balrog_props_task(tasks):
+def get_artifact_json(queue, task_id, name):
+    """Fetches a JSON artifact of the latest run of a task through the
+    shared transport, so it is parsed by funsize.codec instead of the
+    Taskcluster client.
+    """
+    from funsize.transport import get_transport
+    if name.startswith("public/"):
+        url = queue.buildUrl("getLatestArtifact", task_id, name)
+    else:
+        url = queue.buildSignedUrl("getLatestArtifact", task_id, name)
+    return get_transport().get_json(url)
+
+
+def find_balrog_props_task(tasks, queue):
+    from taskcluster.exceptions import TaskclusterFailure
     log.info("Looking for gecko revision in %s", tasks)
-    queue = tc_Queue()
     for task_id in tasks:
         try:
             task_def = queue.task(task_id)
@@ -72,7 +97,7 @@ def find_balrog_props_task(tasks):
             props_name = next(a['name'] for a in
                               previous_artifacts['artifacts']
                               if 'balrog_props.json' in a['name'])
-            balrog_props = queue.getLatestArtifact(task_id, props_name)
+            balrog_props = get_artifact_json(queue, task_id, props_name)
             log.info("Found gecko revision %s in task %s", gecko_revision,
                      task_id)
             return gecko_revision, balrog_props
@@ -82,11 +107,12 @@ def find_balrog_props_task(tasks):
             log.info("skipping %s", task_id)
 
 
-def parse_taskcluster_message(payload):
+def parse_taskcluster_message(payload, queue):
     """Get the necessary data for funsize, from a TC pulse message
 
     Args:
         payload (kombu.Message.body): the pulse message payload
+        queue (taskcluster.Queue): the worker's Taskcluster queue client
     Returns:
         dict: all the task information needed to submit a partial
             mar generation task.
@@ -101,13 +127,12 @@ def parse_taskcluster_message(payload):
     those will be balrog_props.json, which will contain the appName,
     platform and branch
     """
+    from taskcluster.exceptions import TaskclusterFailure
+
     graph_data = dict()
     graph_data['locales'] = list()
     graph_data['mar_urls'] = dict()
 
-    # taskcluster.Queue, not kombu.Queue
-    queue = tc_Queue()
-
     # taskid = payload['status']['taskId']
     taskid = payload.get('status', dict()).get('taskId')
 
@@ -120,14 +145,15 @@ def parse_taskcluster_message(payload):
         log.exception("Unable to load task definition for %s", taskid)
         return
 
-    balrog_data = find_balrog_props_task(task_definition['dependencies'])
+    balrog_data = find_balrog_props_task(task_definition['dependencies'],
+                                         queue)
     if not balrog_data:
         log.warning("Ignoring task %s", taskid)
         return
     graph_data['revision'], balrog_props = balrog_data
     log.debug("balrog_props.json: %s", balrog_props)
 
-    default_signing_format = get_default_signing_format(taskid)
+    default_signing_format = get_default_signing_format(taskid, queue)
 
     try:
         # We don't do Android build partials
@@ -238,8 +264,8 @@ def parse_buildbot_message(payload):
 
     if "locales" in properties:
         log.debug("L10N repack detected")
-        funsize_info = json.loads(properties['funsize_info'])
-        locales = json.loads(properties['locales'])
+        funsize_info = codec.loads(properties['funsize_info'])
+        locales = codec.loads(properties['locales'])
         graph_data['locales'] = [locale for locale, result in locales.iteritems()
                                  if str(result).lower() == 'success' or
                                  str(result) == '0']
@@ -267,13 +293,42 @@ class FunsizeWorker(ConsumerMixin):
 
     def __init__(self, connection, queue_name, bb_exchange, tc_exchange,
                  balrog_client, tc_queue, s3_info, th_api_root,
-                 balrog_worker_api_root, pvt_key):
+                 balrog_worker_api_root, pvt_key, shards=None,
+                 consume_shards=None, priorities=None,
+                 compact_bindings=False, bindings_api=None,
+                 started_at=None, partials_index=None, limits=None,
+                 cost_model=None, backpressure=None, batch_size=1,
+                 batch_delay=5, profiler=None, balrog_store=None,
+                 retry_queues=None, latency=None):
         """Funsize consumer worker
         :type connection: kombu.Connection
         :param queue_name: Full queue name, including queue/<user> prefix
         :type exchange: basestring
         :type balrog_client: funsize.balrog.BalrogClient
         :type queue: taskcluster.Queue
+        :param shards: list of funsize.shards.Shard splitting the bindings
+            into several queues, defaults to a single queue
+        :param consume_shards: names of the shards consumed by this worker,
+            defaults to all shards
+        :param priorities: funsize.priority.PriorityScheduler keyword
+            arguments, used to order graph submissions
+        :param compact_bindings: bind buildbot messages using a single
+            wildcard and filter them locally
+        :param bindings_api: funsize.bindings.BindingsAPI used to apply only
+            the delta between existing and desired bindings on connect
+        :param started_at: process start timestamp, used to report the
+            startup time
+        :param batch_size: number of messages prefetched and planned before
+            their graphs are submitted in priority order. Messages are acked
+            only after their graphs are submitted.
+        :param batch_delay: seconds after which a partial batch is submitted
+        :param profiler: funsize.profiler.SamplingProfiler, tagged with the
+            type and branch of the message being processed
+        :param balrog_store: funsize.prefetch.BalrogStore read before Balrog
+        :param retry_queues: funsize.retry.RetryQueues, failed messages are
+            republished there instead of being acked
+        :param latency: funsize.latency.LatencyTracker following the
+            submitted graphs
         """
         self.connection = connection
         # Using passive mode is important, otherwise pulse returns 403
@@ -286,6 +341,40 @@ class FunsizeWorker(ConsumerMixin):
         self.th_api_root = th_api_root
         self.balrog_worker_api_root = balrog_worker_api_root
         self.pvt_key = pvt_key
+        self.shards = shards or [Shard(None)]
+        if consume_shards is None:
+            consume_shards = [shard.name for shard in self.shards]
+        unknown = set(consume_shards) - set(s.name for s in self.shards)
+        if unknown:
+            raise ValueError("Unknown shards: {}".format(sorted(unknown)))
+        self.consume_shards = consume_shards
+        self.scheduler = PriorityScheduler(**(priorities or {}))
+        self.compact_bindings = compact_bindings
+        self.bindings_api = bindings_api
+        self._binding_plan = None
+        self._queues = None
+        self._bb_filter = None
+        self.started_at = started_at or time.time()
+        self.startup_time = None
+        self.partials_index = partials_index
+        self.limits = limits
+        self.cost_model = cost_model or CostModel()
+        self.backpressure = backpressure
+        self.consumers = []
+        self.consuming = False
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # Unacked messages planned into the scheduler, by delivery tag
+        self._batch = OrderedDict()
+        self._batch_started = None
+        self._current = None
+        self._received = False
+        self.profiler = profiler
+        self.balrog_store = balrog_store
+        self.retry_queues = retry_queues
+        self.producer = None
+        self.latency = latency
+        self.latency_consumer = None
 
     @property
     def bb_routing_keys(self):
@@ -295,35 +384,16 @@ class FunsizeWorker(ConsumerMixin):
         FunsizeWorker uses explicit list of routing keys to match builders we
         are interested in.
         """
-        jobs = [
-            # TODO: move to configs
-            'build.{branch}-{platform}-nightly.*.finished',
-            # old style l10n repacks
-            'build.{branch}-{platform}-l10n-nightly.*.finished',
-            # TODO: find a better way to specify these
-            'build.{branch}-{platform}-l10n-nightly-1.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-2.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-3.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-4.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-5.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-6.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-7.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-8.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-9.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-10.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-11.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-12.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-13.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-14.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-15.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-16.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-17.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-18.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-19.*.finished',
-            'build.{branch}-{platform}-l10n-nightly-20.*.finished',
-        ]
-        return [job.format(branch=branch, platform=platform)
-                for job in jobs
+        return [routing_key for _, _, routing_key in self.bb_bindings]
+
+    @property
+    def bb_bindings(self):
+        """Returns buildbot routing keys as (branch, platform, routing_key)
+        tuples.
+        """
+        return [(branch, platform,
+                 job.format(branch=branch, platform=platform))
+                for job in BB_JOBS
                 for branch in PRODUCTION_BRANCHES + STAGING_BRANCHES
                 for platform in PLATFORMS]
 
@@ -346,47 +416,240 @@ class FunsizeWorker(ConsumerMixin):
             u'route.project.releng.funsize.level-3.date',
         ]
 
+    @property
+    def tc_bindings(self):
+        """Returns taskcluster routing keys as (branch, routing_key) tuples.
+        The branch is the last component of every route.
+        """
+        return [(routing_key.rsplit(".", 1)[-1], routing_key)
+                for routing_key in self.tc_routing_keys]
+
+    @property
+    def shard_bindings(self):
+        """Routing keys split by shard name"""
+        return assign_bindings(self.shards, self.bb_bindings,
+                               self.tc_bindings)
+
+    def shard_queue_name(self, shard_name):
+        shard = next(s for s in self.shards if s.name == shard_name)
+        return shard.queue_name(self.queue_name)
+
+    @property
+    def binding_plan(self):
+        """Desired bindings of every consumed queue, computed once.
+
+        :return: OrderedDict of {queue name: [(exchange name, routing key)]}
+        """
+        if self._binding_plan is None:
+            shard_bindings = OrderedDict(
+                (self.shard_queue_name(name), bindings)
+                for name, bindings in self.shard_bindings.items())
+            plan = plan_bindings(shard_bindings, self.bb_exchange.name,
+                                 self.tc_exchange.name,
+                                 compact=self.compact_bindings)
+            consumed = set(self.shard_queue_name(name)
+                           for name in self.consume_shards)
+            self._binding_plan = OrderedDict(
+                (q, b) for q, b in plan.items() if q in consumed)
+        return self._binding_plan
+
+    @property
+    def filter_bb_messages(self):
+        """Whether buildbot messages arrive through the wildcard binding.
+
+        plan_bindings falls back to explicit bindings when compaction is not
+        possible, in which case every message is already one of ours.
+        """
+        return any(routing_key == BB_WILDCARD
+                   for bindings in self.binding_plan.values()
+                   for _, routing_key in bindings)
+
     @property
     def queues(self):
         """List of queues used by worker.
-        Multiple queues are used to track multiple routing keys.
+        Multiple queues are used to track multiple routing keys. Every
+        consumed shard has its own pulse queue.
+        """
+        if self._queues is None:
+            exchanges = {self.bb_exchange.name: self.bb_exchange,
+                         self.tc_exchange.name: self.tc_exchange}
+            self._queues = [
+                Queue(name=queue_name, exchange=exchanges[exchange],
+                      routing_key=routing_key, durable=True,
+                      exclusive=False, auto_delete=False)
+                for queue_name, bindings in self.binding_plan.items()
+                for exchange, routing_key in bindings]
+        return self._queues
+
+    def reconciled_queues(self, channel):
+        """Applies the binding delta for every consumed queue.
+
+        Returns queues without bindings, so the consumer does not declare all
+        the bindings again. The binding to the retry exchange is kept, expired
+        retries would be dropped while it is missing.
         """
-        bb_queues = [Queue(name=self.queue_name, exchange=self.bb_exchange,
-                           routing_key=routing_key, durable=True,
-                           exclusive=False, auto_delete=False)
-                     for routing_key in self.bb_routing_keys]
-        tc_queues = [Queue(name=self.queue_name, exchange=self.tc_exchange,
-                           routing_key=routing_key, durable=True,
-                           exclusive=False, auto_delete=False)
-                     for routing_key in self.tc_routing_keys]
-        return bb_queues + tc_queues
+        queues = []
+        for queue_name, bindings in self.binding_plan.items():
+            desired = set(bindings)
+            if self.retry_queues:
+                desired.add(self.retry_queues.binding(queue_name))
+            queues.append(reconcile(channel, queue_name, desired,
+                                    self.bindings_api.get(queue_name)))
+        return queues
+
+    def is_interesting_routing_key(self, routing_key):
+        """Exact filtering of messages received through wildcard bindings"""
+        if self._bb_filter is None:
+            self._bb_filter = topic_regex(self.bb_routing_keys)
+        return bool(self._bb_filter.match(routing_key))
+
+    def report_shards(self):
+        """Logs the shard assignment of this worker"""
+        for shard_name, bindings in self.shard_bindings.items():
+            log.info("Shard %s (%s): %s buildbot and %s taskcluster bindings"
+                     "%s", shard_name, self.shard_queue_name(shard_name),
+                     len(bindings["bb"]), len(bindings["tc"]),
+                     ", consuming" if shard_name in self.consume_shards
+                     else "")
 
     def get_consumers(self, Consumer, channel):
         """Implement parent's method called to get the list of consumers"""
-        # Set prefetch_count to 1 to avoid blocking other workers
-        channel.basic_qos(prefetch_size=0, prefetch_count=1, a_global=False)
-        return [Consumer(queues=self.queues, callbacks=[self.process_message])]
-
-    def process_message(self, body, message):
+        # Prefetch a single batch to avoid blocking other workers
+        channel.basic_qos(prefetch_size=0, prefetch_count=self.batch_size,
+                          a_global=False)
+        import requests
+        if self.retry_queues:
+            # Before reconciling, which keeps the retry exchange binding
+            self.retry_queues.declare(channel, list(self.binding_plan))
+            self.producer = Producer(channel)
+        queues = self.queues
+        if self.bindings_api:
+            try:
+                queues = self.reconciled_queues(channel)
+            except requests.RequestException:
+                log.exception("Cannot read existing bindings, declaring all")
+        # A consumer per queue, so failed messages are retried through the
+        # queue they came from
+        consumers = [
+            Consumer(queues=[q for q in queues if q.name == queue_name],
+                     callbacks=[partial(self.process_message,
+                                        queue_name=queue_name)],
+                     accept=["json"])
+            for queue_name in self.binding_plan]
+        if self.latency:
+            self.latency_consumer = Consumer(
+                queues=[self.latency.queue()],
+                callbacks=[self.latency.process_message], accept=["json"])
+            consumers.append(self.latency_consumer)
+        return consumers
+
+    def process_message(self, body, message, queue_name=None):
         """Top level callback processing pulse messages.
         The callback tries to handle and log all exceptions
 
         :type body: kombu.Message.body
         :type message: kombu.Message
+        :param queue_name: queue the message was consumed from
         """
+        self._received = True
+        started = time.time()
+        entry = {"message": message, "queue_name": queue_name, "graphs": 0,
+                 "error": None, "published_at": published_at(body, message),
+                 "fields": {}, "submitted": set(), "skip": set()}
+        if self.retry_queues:
+            # Partials submitted by the previous attempts of the message
+            entry["skip"] = submitted_partials(message)
+        self._current = entry
         try:
             self.dispatch_message(body, message)
-        except Exception:
+        except Exception as excp:
             log.exception("Failed to process message")
+            entry["error"] = "{}: {}".format(type(excp).__name__, excp)
         finally:
-            # TODO: figure out what to do with failed tasks
-            message.ack()
+            self._current = None
+            if self.profiler:
+                self.profiler.message_done()
+            log.info("Processed message %s", format_fields(
+                graphs=entry["graphs"], error=entry["error"],
+                seconds="{:.2f}".format(time.time() - started),
+                **entry["fields"]), extra={"rate_limit": False})
+        if not entry["graphs"]:
+            self.finish_message(entry)
+            return
+        if not self._batch:
+            self._batch_started = time.time()
+        self._batch[message.delivery_tag] = entry
+        if len(self._batch) >= self.batch_size:
+            self.submit_pending()
+
+    def finish_message(self, entry):
+        """Acks a message once all its graphs are submitted.
+
+        Failed messages are republished to the retry queues first, or
+        requeued if that is not possible. The partials submitted so far are
+        recorded in the republished message and skipped by the retries.
+        """
+        message = entry["message"]
+        if entry["error"] and self.retry_queues:
+            try:
+                self.retry_queues.republish(self.producer, message,
+                                            entry["queue_name"],
+                                            entry["error"],
+                                            submitted=entry["submitted"])
+            except Exception:
+                log.exception("Cannot republish failed message, requeueing")
+                message.requeue()
+                return
+        elif entry["error"]:
+            log.warning("Acking failed message %s", message.delivery_tag)
+        message.ack()
 
     def on_consume_ready(self, connection, channel, consumers, **kwargs):
         """Overrides parent's stub method. Called when ready to consume pulse
          messages.
         """
-        log.info('Listening...')
+        self.report_shards()
+        if self.startup_time is None:
+            self.startup_time = time.time() - self.started_at
+        log.info('Listening... (started in %.2fs)', self.startup_time)
+        # The latency tracker keeps consuming while paused
+        self.consumers = [c for c in consumers
+                          if c is not self.latency_consumer]
+        self.consuming = True
+
+    def on_iteration(self):
+        """Overrides parent's stub method. Called before draining events,
+        submits the pending batch when no message arrived during the last
+        drain or the batch is older than batch_delay, then pauses and resumes
+        the consumers according to the backpressure controller.
+        """
+        if self._batch:
+            waited = time.time() - self._batch_started
+            if not self._received or waited >= self.batch_delay:
+                self.submit_pending()
+        self._received = False
+        if self.latency:
+            self.latency.maybe_report()
+        if not self.backpressure:
+            return
+        paused = self.backpressure.should_pause()
+        if paused and self.consuming:
+            log.warning("Too many pending tasks, pausing consumers")
+            for consumer in self.consumers:
+                consumer.cancel()
+            self.consuming = False
+        elif not paused and not self.consuming:
+            log.info("Resuming consumers")
+            for consumer in self.consumers:
+                consumer.consume()
+            self.consuming = True
+
+    def on_consume_end(self, connection, channel):
+        """Overrides parent's stub method. Submits the pending batch before
+        the channel is closed, so the messages are acked.
+        """
+        if self._batch:
+            self.submit_pending()
 
     def dispatch_message(self, body, message):
         """Dispatches incoming pulse messages.
@@ -396,12 +659,20 @@ class FunsizeWorker(ConsumerMixin):
         """
 
         if self.is_tc_message(message):
+            if self.profiler:
+                self.profiler.set_tag("taskcluster")
             # Useful TC data is in message.payload, unlike
             # Buildbot's which is in body['payload']
             log.debug("Message from Taskcluster: %s (%s)", message.payload, message)
-            gdata = parse_taskcluster_message(message.payload)
-            log.info("Parsed message from Taskcluster: %s", gdata)
+            gdata = parse_taskcluster_message(message.payload, self.tc_queue)
         else:
+            routing_key = original_routing_key(message)
+            if self.filter_bb_messages and \
+                    not self.is_interesting_routing_key(routing_key):
+                log.debug("Ignoring %s: not interested", routing_key)
+                return
+            if self.profiler:
+                self.profiler.set_tag("buildbot")
             # buildbot routes have wildcards in which adds to the
             # overhead of working out whether it's one of ours. Since
             # we were accepting all of them before, continue to do so.
@@ -411,6 +682,16 @@ class FunsizeWorker(ConsumerMixin):
             log.error("No data about the task graph available")
             return
 
+        message_type = "taskcluster" if self.is_tc_message(message) \
+            else "buildbot"
+        if self.profiler:
+            self.profiler.set_tag(message_type, gdata["branch"])
+        if self._current:
+            self._current["fields"].update(
+                type=message_type, branch=gdata["branch"],
+                platform=gdata["platform"], locales=len(gdata["locales"]),
+                revision=gdata["revision"][:12])
+
         self.create_partials(
             product=gdata["product"],
             branch=gdata["branch"],
@@ -435,12 +716,13 @@ class FunsizeWorker(ConsumerMixin):
         """
 
         # some messages we get don't have a CC list
-        routes = [message.delivery_info['routing_key']] + \
+        routes = [original_routing_key(message)] + \
             message.headers.get('CC', list())
 
         return any(r in self.tc_routing_keys for r in routes)
 
-    def get_builds(self, product, platform, branch, locale, dest_mar, count=4):
+    def get_builds(self, product, platform, branch, locale, dest_mar, count=4,
+                   release_limit=20):
         """Find relevant releases in Balrog
         Not all releases have all platforms and locales, due
         to Taskcluster migration.
@@ -450,10 +732,22 @@ class FunsizeWorker(ConsumerMixin):
             branch (str): branch name (mozilla-central)
             platform (str): buildbot/taskcluster platform (linux, macosx64)
             locale (str): locale under investigation
+            count (int): number of builds to return
+            release_limit (int): number of most recent releases looked at
         Returns:
             json object from balrog api
         """
-        last_releases = self.balrog_client.get_releases(product, branch)
+        import requests
+        # Not all releases have all platforms and locales, look at a few
+        # more releases than needed. Names are fetched lazily, newest first.
+        last_releases = None
+        if self.balrog_store:
+            last_releases = self.balrog_store.releases(product, branch)
+        if last_releases is None:
+            last_releases = self.balrog_client.iter_releases(
+                product, branch, limit=release_limit)
+        else:
+            last_releases = last_releases[:release_limit]
 
         builds = list()
 
@@ -461,8 +755,7 @@ class FunsizeWorker(ConsumerMixin):
             if len(builds) >= count:
                 return builds
             try:
-                build_from = self.balrog_client.get_build(
-                    release, platform, locale)
+                build_from = self.get_build(release, platform, locale)
 
                 # Balrog may or may not have information about the latest
                 # release already. Don't make partials, as the diff
@@ -473,8 +766,37 @@ class FunsizeWorker(ConsumerMixin):
                 log.debug("Build %s/%s/%s not found: %s",
                           release, platform, locale, excp)
                 continue
+        if len(builds) < count:
+            log.info("Found %s of %s builds for %s/%s/%s in the last %s "
+                     "releases", len(builds), count, branch, platform,
+                     locale, release_limit)
         return builds
 
+    def get_build(self, release, platform, locale):
+        """Returns a build blob from the store or Balrog.
+
+        Builds missing in Balrog raise requests.HTTPError, also when the
+        store knows they are missing.
+        """
+        import requests
+        if not self.balrog_store:
+            return self.balrog_client.get_build(release, platform, locale)
+        found, blob = self.balrog_store.build(release, platform, locale)
+        if found:
+            if blob is None:
+                raise requests.HTTPError("Build {}/{}/{} not found".format(
+                    release, platform, locale))
+            return blob
+        try:
+            blob = self.balrog_client.get_build(release, platform, locale)
+        except requests.HTTPError as excp:
+            if excp.response is not None and \
+                    excp.response.status_code == 404:
+                self.balrog_store.set_build(release, platform, locale, None)
+            raise
+        self.balrog_store.set_build(release, platform, locale, blob)
+        return blob
+
     def create_partials(self, product, branch, platform, locales, revision,
                         mar_urls, mar_signing_format):
         """Calculates "from" and "to" MAR URLs and calls create_task_graph().
@@ -486,10 +808,14 @@ class FunsizeWorker(ConsumerMixin):
         :param locales: list of locales
         :param revision: revision of the "to" build
         :param mar_urls: dictionary of {locale:mar file url} for each locale
+
+        With the "streaming" limit, partials are planned per_chunk at a time
+        as soon as their "from" builds are resolved, instead of after the
+        lookups of all the locales.
         """
-        # TODO: move limit to config
-        partial_limit = 4
-        per_chunk = 5
+        limits = get_limits(self.limits, branch, platform)
+        partial_limit = limits["partial_limit"]
+        streaming = limits["streaming"]
 
         tasks = defaultdict(list)
 
@@ -497,36 +823,153 @@ class FunsizeWorker(ConsumerMixin):
             to_mar = mar_urls.get(locale)
             log.info("Build to: %s", to_mar)
             latest_releases = self.get_builds(
-                product, platform, branch, locale, to_mar, partial_limit)
+                product, platform, branch, locale, to_mar, partial_limit,
+                limits["release_limit"])
             for update_number, build_from in enumerate(latest_releases, start=1):
-                log.info("Build from: %s", build_from)
                 try:
                     from_mar = build_from['completes'][0]['fileUrl']
                 except ValueError as excp:
                     log.error("Unable to extract fileUrl from %s: %s",
                               build_from, excp)
                     continue
+                log.info("Build from: %s", from_mar)
+                filesize = build_from['completes'][0].get('filesize')
+                if filesize:
+                    # Known from Balrog, not requested when packing
+                    self.cost_model.set_size(from_mar, filesize)
 
                 tasks[update_number].append({
                     "locale": locale,
                     "from_mar": from_mar,
                     "to_mar": to_mar,
                 })
+                if streaming and \
+                        len(tasks[update_number]) >= limits["per_chunk"]:
+                    self.plan_partials(
+                        branch, platform, revision, mar_signing_format,
+                        {update_number: tasks.pop(update_number)}, limits)
+
+        # Everything when not streaming, the incomplete chunks otherwise
+        self.plan_partials(branch, platform, revision, mar_signing_format,
+                           tasks, limits)
+
+    def plan_partials(self, branch, platform, revision, mar_signing_format,
+                      tasks, limits):
+        """Schedules the graphs of new partials.
+
+        When streaming, the graphs are submitted right away, together with
+        the graphs already planned for the earlier messages of the batch, in
+        priority order. The messages are still acked when the batch is
+        flushed.
+
+        :param tasks: {update_number: [{"locale", "from_mar", "to_mar"}]}
+        """
+        skip = self._current["skip"] if self._current else None
+        if skip:
+            tasks = dict(
+                (update_number, [e for e in extras if partial_key(
+                    e["from_mar"], e["to_mar"], e["locale"]) not in skip])
+                for update_number, extras in tasks.items())
+            tasks = dict((n, extras) for n, extras in tasks.items() if extras)
+        if self.partials_index:
+            tasks = self.partials_index.filter_new(branch, platform, revision,
+                                                   tasks)
+        if self._current:
+            fields = self._current["fields"]
+            fields["partials"] = fields.get("partials", 0) + sum(
+                len(extras) for extras in tasks.values())
 
         for update_number in tasks:
-            for extra in chunked(tasks[update_number], per_chunk):
+            for extra in self.chunk_partials(platform, update_number,
+                                             tasks[update_number], limits):
                 all_locales = [e["locale"] for e in extra]
                 log.info("New Funsize task for %s", all_locales)
                 locale_desc = "_".join(all_locales)
                 locale_desc = locale_desc.replace('-', '_')
-                self.submit_task_graph(
-                    branch=branch, revision=revision, platform=platform,
-                    update_number=update_number,
-                    extra=extra, locale_desc=locale_desc,
-                    mar_signing_format=mar_signing_format)
+                self.schedule(
+                    dict(branch=branch, revision=revision, platform=platform,
+                         update_number=update_number,
+                         extra=extra, locale_desc=locale_desc,
+                         mar_signing_format=mar_signing_format),
+                    locales=all_locales)
+        if limits["streaming"]:
+            self.submit_scheduled()
+
+    def chunk_partials(self, platform, update_number, extras, limits):
+        """Splits the partials of an update number into generator tasks.
+
+        With a target runtime configured, partials are packed by estimated
+        cost, otherwise in arrival order by per_chunk.
+        """
+        from more_itertools import chunked
+        per_chunk = limits["per_chunk"]
+        target_runtime = limits["target_runtime"]
+        if not target_runtime:
+            return list(chunked(extras, per_chunk))
+        costs = [self.cost_model.estimate(platform, update_number,
+                                          e["from_mar"], e["to_mar"])
+                 for e in extras]
+        chunks = pack(extras, costs, target_runtime, per_chunk)
+        log.debug("Packed %s partials into %s tasks, estimated %s seconds",
+                  len(extras), len(chunks), sum(costs))
+        return chunks
+
+    def schedule(self, graph, locales):
+        """Queues a planned graph of the message being processed"""
+        entry = self._current
+        if entry is None:
+            # Planned outside of a pulse message, submitted right away
+            entry = {"message": None, "queue_name": None, "graphs": 0,
+                     "error": None, "published_at": None,
+                     "submitted": set(), "skip": set()}
+        entry["graphs"] += 1
+        self.scheduler.push((graph, entry), branch=graph["branch"],
+                            locales=locales,
+                            update_number=graph["update_number"])
+        if self._current is None:
+            self.submit_pending()
+
+    def submit_pending(self):
+        """Submits the planned task graphs of all buffered messages in
+        priority order, then acks the messages.
+        """
+        self.submit_scheduled()
+        batch, self._batch = self._batch, OrderedDict()
+        for entry in batch.values():
+            self.finish_message(entry)
+
+    def submit_scheduled(self):
+        """Submits the scheduled task graphs in priority order.
+
+        A failed submission is logged and its partials are forgotten by the
+        index, the other graphs are still submitted. The profiler samples
+        are tagged "submit" meanwhile.
+        """
+        previous_tag = self.profiler.tag if self.profiler else None
+        while self.scheduler:
+            graph, entry = self.scheduler.pop()
+            if self.profiler:
+                self.profiler.set_tag("submit", graph["branch"])
+            try:
+                self.submit_task_graph(published_at=entry["published_at"],
+                                       **graph)
+                entry["submitted"].update(
+                    partial_key(e["from_mar"], e["to_mar"], e["locale"])
+                    for e in graph["extra"])
+            except Exception as excp:
+                log.exception("Failed to submit graph for %s %s/%s",
+                              graph["branch"], graph["platform"],
+                              graph["locale_desc"])
+                entry["error"] = "{}: {}".format(type(excp).__name__, excp)
+                if self.partials_index:
+                    self.partials_index.forget(graph["extra"])
+        if self.profiler:
+            self.profiler.tag = previous_tag
 
     def submit_task_graph(self, branch, revision, platform, update_number,
-                          locale_desc, extra, mar_signing_format):
+                          locale_desc, extra, mar_signing_format,
+                          published_at=None):
+        from taskcluster import slugId
         task_group_id = slugId()
         atomic_task_id = slugId()
         log.info("Submitting a new graph %s", task_group_id)
@@ -543,6 +986,13 @@ class FunsizeWorker(ConsumerMixin):
         # submission of all tasks and unblocks the rest of the tasks.
         log.info("Resolving atomic task %s", atomic_task_id)
         self.resolve_task(atomic_task_id)
+        if self.partials_index:
+            self.partials_index.mark_submitted(branch, platform, revision,
+                                               extra, atomic_task_id)
+        if self.latency:
+            self.latency.submitted(task_group_id, task_graph["tasks"], branch,
+                                   platform, update_number, extra,
+                                   published_at=published_at)
         return task_group_id
 
     def resolve_task(self, task_id, worker_id="funsize"):
@@ -564,8 +1014,8 @@ class FunsizeWorker(ConsumerMixin):
         :param to_mar: "to" MAR URL
         :return: graph definition dictionary
         """
-        template_file = os.path.join(os.path.dirname(__file__), "tasks",
-                                     "funsize.yml")
+        import yaml
+        from taskcluster import stringDate, fromNow, stableSlugId
         extra_balrog_submitter_params = None
         if branch in STAGING_BRANCHES:
             extra_balrog_submitter_params = "--dummy"
@@ -596,16 +1046,30 @@ class FunsizeWorker(ConsumerMixin):
             "extra_balrog_submitter_params": extra_balrog_submitter_params,
             "extra": extra,
             "sign_task": partial(sign_task, pvt_key=self.pvt_key),
+            "partialKey": partial_key,
             "mar_signing_format": mar_signing_format,
             "task_group_id": task_group_id,
             "atomic_task_id": atomic_task_id,
         }
-        with open(template_file) as f:
-            template = Template(f.read(), undefined=StrictUndefined)
-        rendered = template.render(**template_vars)
+        rendered = load_template().render(**template_vars)
         return yaml.safe_load(rendered)
 
 
+_template = None
+
+
+def load_template():
+    """Returns the compiled graph template, read once per process"""
+    global _template
+    if _template is None:
+        from jinja2 import Template, StrictUndefined
+        template_file = os.path.join(os.path.dirname(__file__), "tasks",
+                                     "funsize.yml")
+        with open(template_file) as f:
+            _template = Template(f.read(), undefined=StrictUndefined)
+    return _template
+
+
 def interesting_buildername(buildername):
     """Matches related builder names
 
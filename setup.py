@@ -23,11 +23,14 @@ setup(
         "ecdsa==0.10",
         "enum34==1.0.4",
         "idna==2.2",
+        # Balrog release lists are parsed incrementally
+        "ijson==2.3",
         "importlib==1.0.4",
         "iniparse==0.3.1",
         "ipaddress==1.0.18",
         "Jinja2==2.7.1",
         "kombu==3.0.26",
+        "logutils==0.3.5",
         "MarkupSafe==0.23",
         "more_itertools==2.2",
         "PGPy>=0.4.0",
@@ -36,7 +39,6 @@ setup(
         "pycparser==2.13",
         "pycrypto==2.6.1",
         "python-jose==0.5.6",
-        "redo==1.4.1",
         # Taskcluster pins requests 2.4.3, so we need to de the same,
         # even though we'd rather use a more up-to-date version.
         "requests[security]==2.4.3",
@@ -46,6 +48,14 @@ setup(
         "taskcluster>=0.0.26",
         "wsgiref==0.1.2",
     ],
+    extras_require={
+        # C JSON parser, used by funsize.codec when installed. orjson is
+        # preferred but has no Python 2 build.
+        "fast-json": [
+            "orjson; python_version >= '3.6'",
+            "ujson; python_version < '3'",
+        ],
+    },
     tests_require=[
         'hypothesis',
         'pytest',